@@ -22,6 +22,11 @@ or multiple '|' separated expressions for the individual curves.
 The expressions access the input (horizontal axis) value as 'x',
 and may also refer to each other, provided there are no cycles.
 
+The Bake All Expression Nodes operator re-bakes every labeled node
+in all materials and node groups, and also works in background mode:
+
+blender -b file.blend --addons compile_curves --python-expr "import bpy; bpy.ops.node.bake_all_expressions(); bpy.ops.wm.save_mainfile()"
+
 RGB Curves:
 
 C
@@ -38,6 +43,14 @@ X | Y | Z
 import bpy
 import operator
 import math
+import time
+import struct
+import types
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def get_active_node(context):
     space = context.space_data
@@ -49,28 +62,242 @@ def get_active_node(context):
 
 # Set curve data
 
-def apply_curve(curve, xlist, ylist, mode='AUTO'):
-    while len(curve.points) > 2:
-        curve.points.remove(curve.points[2])
-
-    curve.points[0].location = (xlist[0], ylist[0])
-    curve.points[0].handle_type = mode
-
-    curve.points[1].location = (xlist[1], ylist[1])
-    curve.points[1].handle_type = mode
+def float32(value):
+    return struct.unpack('f', struct.pack('f', value))[0]
 
-    for i in range(2, len(xlist)):
-        pt = curve.points.new(xlist[i], ylist[i])
+def apply_curve(curve, xlist, ylist, mode='AUTO'):
+    """
+    Updates the curve points in place, writing only values that differ
+    as stored in single precision, and adding or removing the difference.
+    Returns True if anything changed.
+    """
+    points = curve.points
+    count = len(xlist)
+    changed = False
+
+    while len(points) > max(count, 2):
+        points.remove(points[len(points)-1])
+        changed = True
+
+    # Existing points keep their order, as the targets are sorted too
+    for i in range(min(count, len(points))):
+        pt = points[i]
+        loc = (float32(xlist[i]), float32(ylist[i]))
+
+        if tuple(pt.location) != loc:
+            pt.location = loc
+            changed = True
+        if pt.handle_type != mode:
+            pt.handle_type = mode
+            changed = True
+
+    # New points have larger x than all existing ones, so they are appended
+    for i in range(len(points), count):
+        pt = points.new(xlist[i], ylist[i])
         pt.handle_type = mode
+        changed = True
+
+    return changed
+
+# Model of curve mapping evaluation, following curvemap_make_table in Blender
+
+CURVE_RESOLUTION = 32       # Points per Bezier segment, CM_RESOL
+CURVE_TABLE_SIZE = 256      # Steps of the lookup table over the clip range, CM_TABLE
+ADAPTIVE_SAMPLES = 1024     # Expression samples that adaptive points are fitted to
+
+def calc_curve_handles(pts, mode):
+    """
+    Computes the left and right handles of curve points like calchandle_curvemap.
+    """
+    n = len(pts)
+    prev = numpy.empty_like(pts)
+    next = numpy.empty_like(pts)
+    prev[1:] = pts[:-1]
+    next[:-1] = pts[1:]
+    prev[0] = 2*pts[0] - next[0]
+    next[-1] = 2*pts[-1] - prev[-1]
+
+    dvec_a = pts - prev
+    dvec_b = next - pts
+
+    if mode == 'VECTOR':
+        return pts - dvec_a/3, pts + dvec_b/3
+
+    len_a = numpy.hypot(dvec_a[:,0], dvec_a[:,1])
+    len_b = numpy.hypot(dvec_b[:,0], dvec_b[:,1])
+    len_a[len_a == 0] = 1
+    len_b[len_b == 0] = 1
+
+    tvec = dvec_b/len_b[:,None] + dvec_a/len_a[:,None]
+    tlen = numpy.hypot(tvec[:,0], tvec[:,1]) * 2.5614
+    tlen[tlen == 0] = numpy.inf
+
+    h1 = pts - tvec*(len_a/tlen)[:,None]
+    h2 = pts + tvec*(len_b/tlen)[:,None]
+
+    # The end handles point at the nearest handle instead of the next point
+    if n > 2:
+        for i, j, h_out, h_in, side in ((0, 1, h2, h1, 1), (n-1, n-2, h1, h2, -1)):
+            hlen = numpy.hypot(*(h_out[i] - pts[i]))
+            vec = h_in[j].copy()
+            vec[0] = max(vec[0], pts[i][0]) if side > 0 else min(vec[0], pts[i][0])
+            vec -= pts[i]
+            nlen = numpy.hypot(*vec)
+
+            if nlen > 1e-7:
+                vec *= hlen/nlen
+                h_out[i] = pts[i] + vec
+                h_in[i] = pts[i] - vec
+
+    return h1, h2
+
+def eval_curve_model(xlist, ylist, mode, xeval, table_range=None):
+    """
+    Evaluates the curve through the given points at xeval, going through
+    the lookup table over table_range (the clip range, by default the
+    range of xeval) like Blender does.
+    """
+    pts = numpy.column_stack((xlist, ylist)).astype(numpy.float64)
+    h1, h2 = calc_curve_handles(pts, mode)
+
+    p0, p3 = pts[:-1], pts[1:]
+    p1, p2 = h2[:-1].copy(), h1[1:].copy()
+
+    # Keep x monotonic within segments, like correct_bezpart
+    len1 = numpy.abs(p0[:,0] - p1[:,0])
+    len2 = numpy.abs(p3[:,0] - p2[:,0])
+    total = len1 + len2
+    seglen = p3[:,0] - p0[:,0]
+    fac = numpy.where(total > seglen, seglen/numpy.where(total > 0, total, 1), 1)[:,None]
+    p1 = p0 - fac*(p0 - p1)
+    p2 = p3 - fac*(p3 - p2)
+
+    t = numpy.linspace(0, 1, CURVE_RESOLUTION)[None,:,None]
+    u = 1-t
+    curve = u*u*u*p0[:,None] + 3*u*u*t*p1[:,None] + 3*u*t*t*p2[:,None] + t*t*t*p3[:,None]
+    curve = curve.reshape(-1, 2)
+
+    min_x, max_x = table_range or (numpy.min(xeval), numpy.max(xeval))
+    table_x = numpy.linspace(min_x, max_x, CURVE_TABLE_SIZE+1)
+    table_y = numpy.interp(table_x, curve[:,0], curve[:,1])
+
+    return numpy.interp(xeval, table_x, table_y)
+
+def fit_curve_adaptive(xlist, ylist, mode, max_error, max_points):
+    """
+    Picks a subset of the samples as curve points, so that the modeled
+    curve stays within max_error of all samples, or max_points is hit.
+    Points are kept at least one lookup table step apart, as closer ones
+    can't improve the curve. Returns the ascending sample indices and
+    the achieved max error.
+    """
+    x = numpy.asarray(xlist, dtype=numpy.float64)
+    y = numpy.asarray(ylist, dtype=numpy.float64)
+    step = (x[-1] - x[0]) / CURVE_TABLE_SIZE
+    chosen = [0, len(x)-1]
+
+    while True:
+        err = numpy.abs(eval_curve_model(x[chosen], y[chosen], mode, x) - y)
+        worst = float(err.max())
+
+        if worst <= max_error or len(chosen) >= max_points:
+            return chosen, worst
+
+        # Split every segment that is off by too much at its worst sample
+        split = []
+
+        for a, b in zip(chosen, chosen[1:]):
+            inner = numpy.flatnonzero((x[a+1:b] - x[a] >= step) & (x[b] - x[a+1:b] >= step))
+
+            if len(inner):
+                i = a + 1 + int(inner[err[a+1:b][inner].argmax()])
+                if err[i] > max_error:
+                    split.append((err[i], i))
+
+        if not split:
+            return chosen, worst
+
+        split.sort(reverse=True)
+        chosen = sorted(chosen + [ i for e, i in split[:max_points-len(chosen)] ])
 
 # Compute data
 
 def generate_x_list(min_x, max_x, count):
     return [ min_x + i*(max_x-min_x) / (count-1) for i in range(0,count) ]
 
-def generate_expr_data(expr, count, inputs):
+# Names from the math module with a NumPy ufunc of different name
+numpy_math_aliases = {
+    'pow': 'power', 'atan2': 'arctan2',
+    'asin': 'arcsin', 'acos': 'arccos', 'atan': 'arctan',
+    'asinh': 'arcsinh', 'acosh': 'arccosh', 'atanh': 'arctanh',
+}
+
+def get_vector_namespace(global_map):
+    """
+    Returns a copy of the driver namespace with the math functions and
+    any function that has a registered '<name>_array' version replaced
+    by array versions, or None if NumPy is not available.
+    """
+    if numpy is None:
+        return None
+
+    vector_map = dict(global_map)
+
+    for name, value in global_map.items():
+        if getattr(math, name, None) is value and callable(value):
+            func = getattr(numpy, numpy_math_aliases.get(name, name), None)
+            if isinstance(func, numpy.ufunc):
+                vector_map[name] = func
+        elif name + '_array' in global_map:
+            vector_map[name] = global_map[name + '_array']
+
+    return vector_map
+
+def get_code_names(code):
+    "Returns the names used by a code object, including nested ones."
+    names = set(code.co_names)
+
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= get_code_names(const)
+
+    return names
+
+def generate_expr_data_vector(expr, count, inputs, vector_map):
+    """
+    Evaluates the expression once over arrays, returning None if that
+    fails or gives non-finite values, e.g. due to scalar only functions.
+    A scalar result is only accepted from an expression using no inputs,
+    otherwise it is likely an aggregate like max(x) or sum(x).
+    """
+    locmap = { k:numpy.asarray(v, dtype=numpy.float64) for k,v in inputs.items() }
+
+    try:
+        with numpy.errstate(all='ignore'):
+            result = numpy.asarray(eval(expr, vector_map, locmap), dtype=numpy.float64)
+    except Exception:
+        return None
+
+    if result.shape == ():
+        if not get_code_names(expr).isdisjoint(inputs):
+            return None
+        result = numpy.full((count,), result)
+    elif result.shape != (count,):
+        return None
+
+    if not numpy.all(numpy.isfinite(result)):
+        return None
+
+    return result.tolist()
+
+def generate_expr_data(expr, count, inputs, vector_map=None):
     global_map = bpy.app.driver_namespace
 
+    if vector_map is not None:
+        result = generate_expr_data_vector(expr, count, inputs, vector_map)
+        if result is not None:
+            return result
+
     def evalfn(i):
         locmap = { k:v[i] for k,v in inputs.items() }
         return float(eval(expr, global_map, locmap))
@@ -103,13 +330,14 @@ def evaluate_curves(op, count, min_x, max_x, label, invar, shapes):
     results[invar] = generate_x_list(min_x, max_x, count)
 
     min_y, max_y = None, None
+    vector_map = get_vector_namespace(bpy.app.driver_namespace)
 
     while len(expr_table) > 0:
         for eid, expr in expr_table.items():
             unresolved = [ ids for ids in expr.co_names if ids in expr_table ]
             if unresolved == []:
                 try:
-                    earr = generate_expr_data(expr, count, results)
+                    earr = generate_expr_data(expr, count, results, vector_map)
                 except Exception as e:
                     op.report({'ERROR_INVALID_INPUT'}, "Error evaluating the python expression for %s in node label: %s." % (eid, e))
                     return None
@@ -130,57 +358,148 @@ def evaluate_curves(op, count, min_x, max_x, label, invar, shapes):
     return results, min_y, max_y
 
 
+# Memoized evaluation, for baking many nodes with the same labels
+
+class ReportCapture:
+    """Records operator reports, so that they can be replayed later."""
+    def __init__(self):
+        self.reports = []
+
+    def report(self, type, message):
+        self.reports.append((type, message))
+
+def evaluate_curves_cached(op, cache, count, min_x, max_x, label, invar, shapes):
+    if cache is None:
+        return evaluate_curves(op, count, min_x, max_x, label, invar, shapes)
+
+    key = (label, count, min_x, max_x, invar, tuple(sorted((k, tuple(v)) for k,v in shapes.items())))
+
+    if key not in cache:
+        reports = ReportCapture()
+        cache[key] = (evaluate_curves(reports, count, min_x, max_x, label, invar, shapes), reports.reports)
+
+    curve_data, reports = cache[key]
+
+    # Errors are repeated for every node with the same label
+    for type, message in reports:
+        op.report(type, message)
+
+    if curve_data is None:
+        return None
+
+    # The bakers may modify the lists
+    curve_vals, min_y, max_y = curve_data
+    return { k:list(v) for k,v in curve_vals.items() }, min_y, max_y
+
+# Bake a node
+
+def bake_curve_node(op, node, num_points, use_bezier, cache=None, max_error=None, stats=None):
+    """
+    Bakes the node label to curves. With max_error, the points are placed
+    adaptively, using num_points as the limit for each curve.
+    """
+    mapping = node.mapping
+
+    if max_error is not None and numpy is None:
+        op.report({'WARNING'}, "Adaptive points need NumPy, using uniform points.")
+        max_error = None
+    min_x = mapping.clip_min_x
+    max_x = mapping.clip_max_x
+
+    # Compute curve values
+    if node.type == "CURVE_VEC":
+        shapes = { 1: ['XYZ'], 3: ['X','Y','Z'] }
+        curvenames = ['X','Y','Z']
+    else:
+        shapes = { 1: ['C'], 3: ['R','G','B'], 4: ['C','R','G','B'] }
+        curvenames = ['R','G','B','C']
+
+    count = num_points if max_error is None else ADAPTIVE_SAMPLES
+    curve_data = evaluate_curves_cached(op, cache, count, min_x, max_x, node.label, 'x', shapes)
+
+    if curve_data is None:
+        return False
+
+    # Apply values to node data
+    curve_vals, min_y, max_y = curve_data
+    xvec = curve_vals['x']
+    fallback = curve_vals.get('XYZ')
+
+    changed = False
+
+    if (mapping.clip_min_y, mapping.clip_max_y) != (float32(min_y), float32(max_y)):
+        mapping.clip_min_y, mapping.clip_max_y = min_y, max_y
+        changed = True
+
+    mode = 'AUTO' if use_bezier else 'VECTOR'
+    max_points, max_delta = 2, 0.0
+
+    for i,v in enumerate(curvenames):
+        yvec = curve_vals.get(v, fallback)
+
+        if not yvec:
+            changed |= apply_curve(mapping.curves[i], [0.0, 1.0], [0.0, 1.0], mode)
+        elif max_error is None:
+            changed |= apply_curve(mapping.curves[i], xvec, yvec, mode)
+            max_points = len(xvec)
+        else:
+            indices, delta = fit_curve_adaptive(xvec, yvec, mode, max_error, num_points)
+            changed |= apply_curve(mapping.curves[i], [ xvec[j] for j in indices ], [ yvec[j] for j in indices ], mode)
+            max_points, max_delta = max(max_points, len(indices)), max(max_delta, delta)
+
+    if stats is not None:
+        stats['points'] = max_points
+        stats['error'] = max_delta if max_error is not None else None
+
+    # Update mapping and UI
+    if changed:
+        mapping.update()
+        node.width = node.width
+
+    return True
+
 class NODE_OT_bake_expression_to_curves(bpy.types.Operator):
     """Generate curve points from label interpreted as expression."""
     bl_idname = "node.bake_expression_to_curves"
     bl_label = "Bake Expression to Curves"
     bl_options = {'REGISTER', 'UNDO'}
 
-    num_points = bpy.props.IntProperty(name="Points",description="Number of points to generate",default=64,min=2,max=256)
+    num_points = bpy.props.IntProperty(name="Points",description="Number of points to generate, or the limit in adaptive mode",default=64,min=2,max=256)
     use_bezier = bpy.props.BoolProperty(name="Bezier",description="Use bezier handle type",default=True)
+    use_adaptive = bpy.props.BoolProperty(name="Adaptive",description="Place points where needed to meet the max error",default=False)
+    max_error = bpy.props.FloatProperty(name="Max Error",description="Allowed deviation from the expression in adaptive mode",default=0.001,min=0.000001,precision=6)
+
+    # Results shown in the redo panel
+    result_points = bpy.props.IntProperty(options={'HIDDEN', 'SKIP_SAVE'})
+    result_error = bpy.props.FloatProperty(options={'HIDDEN', 'SKIP_SAVE'})
 
     @classmethod
     def poll(cls, context):
         node = get_active_node(context)
         return node and (node.type == "CURVE_RGB" or node.type == "CURVE_VEC")
 
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "num_points")
+        layout.prop(self, "use_bezier")
+        layout.prop(self, "use_adaptive")
+
+        if self.use_adaptive:
+            layout.prop(self, "max_error")
+            layout.label("Achieved: %d points, max error %.6f" % (self.result_points, self.result_error))
+
     def execute(self, context):
         node = get_active_node(context)
-        mapping = node.mapping
-        min_x = mapping.clip_min_x
-        max_x = mapping.clip_max_x
-
-        # Compute curve values
-        if node.type == "CURVE_VEC":
-            shapes = { 1: ['XYZ'], 3: ['X','Y','Z'] }
-            curvenames = ['X','Y','Z']
-        else:
-            shapes = { 1: ['C'], 3: ['R','G','B'], 4: ['C','R','G','B'] }
-            curvenames = ['R','G','B','C']
-
-        curve_data = evaluate_curves(self, self.num_points, min_x, max_x, node.label, 'x', shapes)
+        max_error = self.max_error if self.use_adaptive else None
+        stats = {}
 
-        if curve_data is None:
+        if not bake_curve_node(self, node, self.num_points, self.use_bezier, max_error=max_error, stats=stats):
             return {'CANCELLED'}
 
-        # Apply values to node data
-        curve_vals, mapping.clip_min_y, mapping.clip_max_y = curve_data
-        xvec = curve_vals['x']
-        fallback = curve_vals.get('XYZ')
-
-        mode = 'AUTO' if self.use_bezier else 'VECTOR'
-
-        for i,v in enumerate(curvenames):
-            if v in curve_vals:
-                apply_curve(mapping.curves[i], xvec, curve_vals[v], mode)
-            elif fallback:
-                apply_curve(mapping.curves[i], xvec, fallback, mode)
-            else:
-                apply_curve(mapping.curves[i], [0.0, 1.0], [0.0, 1.0], mode)
+        self.result_points = stats['points']
+        self.result_error = stats['error'] or 0.0
 
-        # Update mapping, UI and force shader refresh
-        mapping.update()
-        node.width = node.width
+        # Force shader refresh
         context.space_data.node_tree.update_tag()
 
         return {'FINISHED'}
@@ -189,6 +508,124 @@ def sqdist_metric(a,b):
     d = (a[0]-b[0], a[1]-b[1], a[2]-b[2], a[3]-b[3])
     return d[0]*d[0] + d[1]*d[1] + d[2]*d[2] + d[3]*d[3]
 
+def fit_ramp_greedy(ramp, xvec, cvec):
+    """
+    Adds ramp elements one at a time at the worst matching sample,
+    using the ramp itself for evaluation. Returns the max error.
+    """
+    xvec = list(xvec)
+    xvec[0] = None
+    xvec[-1] = None
+
+    while True:
+        max_delta = -1.0
+        max_i = None
+
+        for i,x in enumerate(xvec):
+            if x is not None:
+                delta_val = sqdist_metric(cvec[i], ramp.evaluate(x))
+
+                if delta_val > max_delta:
+                    max_delta = delta_val
+                    max_i = i
+
+        if len(ramp.elements) >= 32 or max_delta <= 0.000001:
+            return max_delta
+
+        pt = ramp.elements.new(xvec[max_i])
+        pt.color = cvec[max_i]
+        xvec[max_i] = None
+
+def fit_ramp_linear(xvec, cvec, max_elements=32, tolerance=0.000001):
+    """
+    Chooses samples as stops of a linearly interpolated ramp, minimizing
+    the max squared error by dynamic programming over the stop count.
+    Uses the fewest stops that meet tolerance, up to max_elements.
+    Returns the ascending sample indices of the stops and the max error.
+    """
+    x = numpy.asarray(xvec, dtype=numpy.float64)
+    c = numpy.asarray(cvec, dtype=numpy.float64)
+    n = len(x)
+
+    # cost[i,j]: max error of the samples between stops at samples i < j
+    cost = numpy.full((n, n), numpy.inf)
+
+    for i in range(n-1):
+        # With d = c[j]-c[i], e = c[m]-c[i] and f = (x[m]-x[i])/(x[j]-x[i]),
+        # the error at sample m is |f*d - e|^2 = f^2 |d|^2 - 2f d.e + |e|^2
+        dx = x[i+1:] - x[i]
+        dc = c[i+1:] - c[i]
+        sq = (dc*dc).sum(axis=1)
+        frac = dx[None,:] / dx[:,None]
+        delta = frac*(frac*sq[:,None] - 2*dc.dot(dc.T)) + sq[None,:]
+        cost[i,i+1:] = numpy.tril(delta, -1).max(axis=1)
+
+    # best[j]: min max error of reaching sample j from sample 0 with k segments
+    best = cost[0].copy()
+    columns = numpy.arange(n)
+    parents = []
+
+    while best[n-1] > tolerance and len(parents) + 2 < max_elements:
+        cand = numpy.maximum(best[:,None], cost)
+        prev = cand.argmin(axis=0)
+        best = cand[prev, columns]
+        parents.append(prev)
+
+    indices = [n-1]
+    for prev in reversed(parents):
+        indices.append(int(prev[indices[-1]]))
+    indices.append(0)
+
+    return indices[::-1], float(best[n-1])
+
+def bake_ramp_node(op, node, cache=None):
+    ramp = node.color_ramp
+
+    shapes = { 1: ['C'], 2: ['C','A'], 4: ['R','G','B','A'] }
+    curve_data = evaluate_curves_cached(op, cache, 256, 0.0, 1.0, node.label, 'x', shapes)
+
+    if curve_data is None:
+        return False
+
+    # Compute target colors
+    curve_vals, min_y, max_y = curve_data
+
+    curve_c = curve_vals.get('C')
+    curve_r = curve_vals.get('R', curve_c)
+    curve_g = curve_vals.get('G', curve_c)
+    curve_b = curve_vals.get('B', curve_c)
+    curve_a = curve_vals.get('A', curve_c)
+
+    xvec = curve_vals['x']
+    cvec = [(curve_r[i], curve_g[i], curve_b[i], curve_a[i]) for i in range(0,len(xvec))]
+
+    # Apply edge values
+    while len(ramp.elements) > 2:
+        ramp.elements.remove(ramp.elements[2])
+
+    ramp.elements[0].position = xvec[0]
+    ramp.elements[0].color = cvec[0]
+
+    ramp.elements[1].position = xvec[-1]
+    ramp.elements[1].color = cvec[-1]
+
+    # Apply midpoints
+    if numpy is not None and ramp.interpolation == 'LINEAR' and ramp.color_mode == 'RGB':
+        indices, max_delta = fit_ramp_linear(xvec, cvec)
+
+        for i in indices[1:-1]:
+            pt = ramp.elements.new(xvec[i])
+            pt.color = cvec[i]
+    else:
+        max_delta = fit_ramp_greedy(ramp, xvec, cvec)
+
+    op.report({'INFO'}, 'Max remaining error: %f' % (math.sqrt(max_delta)))
+
+    # Update UI
+    node.width = node.width
+
+    return True
+
 class NODE_OT_bake_expression_to_ramp(bpy.types.Operator):
     """Generate color ramp points from label interpreted as expression."""
     bl_idname = "node.bake_expression_to_ramp"
@@ -202,62 +639,81 @@ class NODE_OT_bake_expression_to_ramp(bpy.types.Operator):
 
     def execute(self, context):
         node = get_active_node(context)
-        ramp = node.color_ramp
-
-        shapes = { 1: ['C'], 2: ['C','A'], 4: ['R','G','B','A'] }
-        curve_data = evaluate_curves(self, 256, 0.0, 1.0, node.label, 'x', shapes)
 
-        if curve_data is None:
+        if not bake_ramp_node(self, node):
             return {'CANCELLED'}
 
-        # Compute target colors
-        curve_vals, min_y, max_y = curve_data
+        # Force shader refresh
+        context.space_data.node_tree.update_tag()
 
-        curve_c = curve_vals.get('C')
-        curve_r = curve_vals.get('R', curve_c)
-        curve_g = curve_vals.get('G', curve_c)
-        curve_b = curve_vals.get('B', curve_c)
-        curve_a = curve_vals.get('A', curve_c)
+        return {'FINISHED'}
 
-        xvec = curve_vals['x']
-        cvec = [(curve_r[i], curve_g[i], curve_b[i], curve_a[i]) for i in range(0,len(xvec))]
 
-        # Apply edge values
-        while len(ramp.elements) > 2:
-            ramp.elements.remove(ramp.elements[2])
+class PrefixReporter:
+    """Forwards bake errors of one node to the operator, prefixed with its location."""
+    def __init__(self, op, prefix):
+        self.op = op
+        self.prefix = prefix
 
-        ramp.elements[0].position = xvec[0]
-        ramp.elements[0].color = cvec[0]
-        xvec[0] = None
+    def report(self, type, message):
+        # Per-node info like the remaining ramp error would flood the log
+        if 'INFO' not in type:
+            self.op.report({'WARNING'}, self.prefix + message)
 
-        ramp.elements[1].position = xvec[-1]
-        ramp.elements[1].color = cvec[-1]
-        xvec[-1] = None
+def get_bake_node_trees():
+    for mat in bpy.data.materials:
+        if mat.node_tree and not mat.library:
+            yield 'Material ' + mat.name, mat.node_tree
 
-        # Apply midpoints
-        while True:
-            max_delta = -1.0
-            max_i = None
+    for group in bpy.data.node_groups:
+        if not group.library:
+            yield 'Group ' + group.name, group
 
-            for i,x in enumerate(xvec):
-                if x is not None:
-                    delta_val = sqdist_metric(cvec[i], ramp.evaluate(x))
+class NODE_OT_bake_all_expressions(bpy.types.Operator):
+    """Bake all labeled curve and ramp nodes in materials and node groups."""
+    bl_idname = "node.bake_all_expressions"
+    bl_label = "Bake All Expression Nodes"
+    bl_options = {'REGISTER', 'UNDO'}
 
-                    if delta_val > max_delta:
-                        max_delta = delta_val
-                        max_i = i
+    num_points = bpy.props.IntProperty(name="Points",description="Number of points to generate for curves",default=64,min=2,max=256)
+    use_bezier = bpy.props.BoolProperty(name="Bezier",description="Use bezier handle type for curves",default=True)
+    use_adaptive = bpy.props.BoolProperty(name="Adaptive",description="Place curve points where needed to meet the max error",default=False)
+    max_error = bpy.props.FloatProperty(name="Max Error",description="Allowed deviation of curves in adaptive mode",default=0.001,min=0.000001,precision=6)
 
-            if len(ramp.elements) >= 32 or max_delta <= 0.000001:
-                self.report({'INFO'}, 'Max remaining error: %f' % (math.sqrt(max_delta)))
-                break
+    def execute(self, context):
+        cache = {}
+        start = time.perf_counter()
+        baked, failed, trees = 0, 0, 0
 
-            pt = ramp.elements.new(xvec[max_i])
-            pt.color = cvec[max_i]
-            xvec[max_i] = None
+        for tree_name, tree in get_bake_node_trees():
+            tree_start = time.perf_counter()
+            tree_baked = 0
 
-        # Update UI and force shader refresh
-        node.width = node.width
-        context.space_data.node_tree.update_tag()
+            for node in tree.nodes:
+                if not node.label or node.type not in {"CURVE_RGB", "CURVE_VEC", "VALTORGB"}:
+                    continue
+
+                reporter = PrefixReporter(self, '%s, node %s: ' % (tree_name, node.name))
+
+                if node.type == "VALTORGB":
+                    ok = bake_ramp_node(reporter, node, cache)
+                else:
+                    ok = bake_curve_node(reporter, node, self.num_points, self.use_bezier, cache,
+                                         max_error=self.max_error if self.use_adaptive else None)
+
+                if ok:
+                    tree_baked += 1
+                else:
+                    failed += 1
+
+            if tree_baked:
+                tree.update_tag()
+                trees += 1
+                baked += tree_baked
+                print('%s: baked %d nodes in %.3fs' % (tree_name, tree_baked, time.perf_counter() - tree_start))
+
+        self.report({'INFO'}, 'Baked %d nodes in %d trees (%d failed, %d unique expressions) in %.3fs' % (
+            baked, trees, failed, len(cache), time.perf_counter() - start))
 
         return {'FINISHED'}
 
@@ -278,6 +734,7 @@ class NODE_MT_bake_expression_to_curves_help(bpy.types.Menu):
             layout.label("Bakes a python expression in node label to curve points.")
             layout.label("Set input range via Min X and Max X in Clipping Options.")
             layout.label("Use F6 menu to set the number of points or toggle bezier.")
+            layout.label("Adaptive mode places points to meet a max error instead.")
 
         layout.separator()
         layout.label("The label may contain multiple '|' separated expressions.")
@@ -322,6 +779,7 @@ def panel_func(self, context):
 def register():
     bpy.utils.register_class(NODE_OT_bake_expression_to_curves)
     bpy.utils.register_class(NODE_OT_bake_expression_to_ramp)
+    bpy.utils.register_class(NODE_OT_bake_all_expressions)
     bpy.utils.register_class(NODE_MT_bake_expression_to_curves_help)
 
     if bpy.types.NODE_PT_active_node_generic:
@@ -330,6 +788,7 @@ def register():
 def unregister():
     bpy.utils.unregister_class(NODE_OT_bake_expression_to_curves)
     bpy.utils.unregister_class(NODE_OT_bake_expression_to_ramp)
+    bpy.utils.unregister_class(NODE_OT_bake_all_expressions)
     bpy.utils.unregister_class(NODE_MT_bake_expression_to_curves_help)
 
     if bpy.types.NODE_PT_active_node_generic:
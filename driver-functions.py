@@ -1,9 +1,19 @@
 import bpy
 import math
+import time
+import bisect
+import collections
+
+from bpy.app.handlers import persistent
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Soft MIN/MAX functions
 
-def softmax_power_solve(radius,limit):
+def softmax_power_solve_iterative(radius,limit):
     """
     Iteratively solves for a power coefficient that produces target deviation at radius.
     """
@@ -46,10 +56,175 @@ def softmax_power_solve(radius,limit):
         if abs(dv/limit-1) < 1e-6:
             return val
 
-#print(softmax_power_solve(1.0,1e-6))
+#print(softmax_power_solve_iterative(1.0,1e-6))
+
+# With u = coeff*radius the equation reduces to g(u) = limit/radius, where
+# g(u) = log1p(exp(-u))/u. Both ln(g) and ln(u) are smooth in each other, so
+# a table of (ln g, ln u) pairs interpolated linearly gives a starting point
+# that Newton's method in ln(u) finishes in one or two steps.
+
+def softmax_g_log(u):
+    """
+    Returns ln(g(u)) and its derivative with respect to ln(u).
+    """
+    e = math.exp(-u)
+    g = math.log1p(e)/u
+    return math.log(g), -1 - e/((1+e)*g)
+
+def softmax_build_table(lo=-9.0, hi=4.0, steps=256):
+    lnu = [ lo + (hi-lo)*i/steps for i in range(steps+1) ]
+    # ln(g) decreases with u, store it negated to keep the table ascending
+    neg_lng = [ -softmax_g_log(math.exp(v))[0] for v in lnu ]
+    return neg_lng, lnu
+
+softmax_table_x, softmax_table_y = softmax_build_table()
+
+def softmax_power_guess(lnt):
+    """
+    Interpolates ln(u) for the target ln(limit/radius) from the table.
+    """
+    xs, ys = softmax_table_x, softmax_table_y
+    i = bisect.bisect_left(xs, -lnt)
+
+    if i == 0:
+        # Large targets: g(u) ~ ln(2)/u - 1/2
+        return math.log(logn_2/(math.exp(lnt)+0.5))
+    if i == len(xs):
+        # Small targets: g(u) ~ exp(-u)/u
+        return math.log(-lnt - ys[-1])
+
+    f = (-lnt - xs[i-1])/(xs[i] - xs[i-1])
+    return ys[i-1] + f*(ys[i] - ys[i-1])
+
+def softmax_power_newton(radius,limit):
+    """
+    Refines the table guess with Newton's method in ln(u), returning
+    None if it doesn't converge within a few steps.
+    """
+    lnt = math.log(limit/radius)
+
+    try:
+        lnu = softmax_power_guess(lnt)
+
+        for i in range(4):
+            u = math.exp(lnu)
+            lng, slope = softmax_g_log(u)
+
+            # Relative error of the deviation, as checked by the iterative solver
+            if abs(math.expm1(lng - lnt)) < 1e-7:
+                return u/radius
+
+            lnu -= (lng - lnt)/slope
+    except (ValueError, OverflowError, ZeroDivisionError):
+        pass
+
+    return None
+
+def softmax_power_solve(radius,limit):
+    """
+    Solves for a power coefficient that produces target deviation at radius.
+    """
+    if radius == 0:
+        return logn_2/limit
+
+    val = softmax_power_newton(radius, limit)
+    if val is None:
+        val = softmax_power_solve_iterative(radius, limit)
+    return val
+
+def softmax_power_check(radii=None, limits=None):
+    """
+    Sweeps the fast solver over realistic radius and limit ranges, returning
+    the worst relative deviation error and the number of fallbacks needed.
+    """
+    radii = radii or [ 10**(e/4) for e in range(-16, 13) ]
+    limits = limits or [ 10**(e/4) for e in range(-32, 1) ]
+    worst, fallbacks = 0, 0
+
+    for radius in radii:
+        for limit in limits:
+            coeff = softmax_power_newton(radius, limit)
+            if coeff is None:
+                fallbacks += 1
+                coeff = softmax_power_solve_iterative(radius, limit)
+
+            dv = math.log1p(math.exp(-coeff*radius))/coeff
+            worst = max(worst, abs(dv/limit-1))
+
+    return worst, fallbacks
+
+#print(softmax_power_check())
 
 logn_2 = math.log(2)
-softmax_coeff_table = {} # cache table
+
+class SoftmaxCoeffCache:
+    """
+    Bounded LRU cache of solved power coefficients keyed by (limit, radius).
+    With digits set, keys are rounded to that many significant digits, so an
+    animated radius reuses nearby solutions instead of solving every frame.
+    """
+    def __init__(self, max_size=1024, digits=None):
+        self.table = collections.OrderedDict()
+        self.max_size = max_size
+        self.digits = digits
+        self.hits = self.misses = self.evictions = 0
+
+    def quantize(self, value):
+        if self.digits is None or value == 0:
+            return value
+        return float('%.*g' % (self.digits, value))
+
+    def get(self, radius, limit):
+        radius, limit = self.quantize(radius), self.quantize(limit)
+        key = (limit, radius)
+
+        try:
+            val = self.table[key]
+        except KeyError:
+            self.misses += 1
+            val = self.table[key] = softmax_power_solve(radius, limit)
+
+            while len(self.table) > self.max_size:
+                self.table.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self.table.move_to_end(key)
+
+        return val
+
+    def clear(self):
+        self.table.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return dict(
+            hits=self.hits, misses=self.misses, evictions=self.evictions,
+            size=len(self.table), max_size=self.max_size, digits=self.digits,
+        )
+
+softmax_coeff_cache = SoftmaxCoeffCache()
+
+def softmax_cache_configure(max_size=None, digits=False):
+    """
+    Changes the cache size limit and/or key quantization (None for exact keys).
+    """
+    cache = softmax_coeff_cache
+
+    if max_size is not None:
+        if max_size < 1:
+            raise ValueError("softmax cache size must be positive")
+        cache.max_size = max_size
+    if digits is not False:
+        cache.digits = digits
+
+    cache.clear()
+
+def softmax_cache_stats():
+    """
+    Returns the hit, miss, eviction and size counters of the coefficient cache.
+    """
+    return softmax_coeff_cache.stats()
 
 def softmax_power(radius,limit):
     """
@@ -65,16 +240,7 @@ def softmax_power(radius,limit):
     if radius == 0:
         return logn_2/limit
 
-    try:
-        ctab = softmax_coeff_table[limit]
-    except KeyError:
-        ctab = softmax_coeff_table[limit] = {}
-
-    try:
-        return ctab[radius]
-    except KeyError:
-        val = ctab[radius] = softmax_power_solve(radius, limit)
-        return val
+    return softmax_coeff_cache.get(radius, limit)
 
 def softmaxp(x,y,power):
     """
@@ -102,7 +268,271 @@ def softmin(x,y,radius=1.0,limit=0.01):
     """
     return softminp(x,y,softmax_power(radius,limit))
 
-bpy.app.driver_namespace['softmaxp'] = softmaxp
-bpy.app.driver_namespace['softmax'] = softmax
-bpy.app.driver_namespace['softminp'] = softminp
-bpy.app.driver_namespace['softmin'] = softmin
+def softmaxnp(values,power):
+    """
+    Log-sum-exp maximum of any number of values, in one pass after max().
+    Equal to softmaxp for two values.
+    """
+    top = max(values)
+    skipped = False
+    total = 0.0
+
+    for v in values:
+        if v == top and not skipped:
+            skipped = True
+        else:
+            total += math.exp(-power*(top-v))
+
+    return top + math.log1p(total)/power
+
+def softmaxn(*values, radius=1.0, limit=0.01):
+    """
+    A maximum like function of any number of values with smoothed out corners.
+    Unlike nested softmax calls, the result doesn't depend on the argument order.
+    """
+    return softmaxnp(values, softmax_power(radius,limit))
+
+def softminn(*values, radius=1.0, limit=0.01):
+    """
+    A minimum like function of any number of values with smoothed out corners.
+    """
+    return -softmaxnp([ -v for v in values ], softmax_power(radius,limit))
+
+# Pre-bound versions, for rigs that use fixed constants:
+#
+#   bpy.app.driver_namespace['jaw_max'] = softmax_bind(0.2, 0.001)
+
+class BoundSoftmax:
+    """
+    softmax with the power coefficient resolved once for a radius & limit.
+    """
+    __slots__ = ('radius', 'limit', 'power')
+
+    def __init__(self, radius=1.0, limit=0.01):
+        self.radius = radius
+        self.limit = limit
+        self.power = softmax_power(radius, limit)
+
+    def __call__(self, x, y):
+        power = self.power
+        return max(x,y) + math.log1p(math.exp(-power*abs(x-y)))/power
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (type(self).__name__, self.radius, self.limit)
+
+class BoundSoftmin(BoundSoftmax):
+    """
+    softmin with the power coefficient resolved once for a radius & limit.
+    """
+    __slots__ = ()
+
+    def __call__(self, x, y):
+        power = self.power
+        return min(x,y) - math.log1p(math.exp(-power*abs(x-y)))/power
+
+def softmax_bind(radius=1.0,limit=0.01):
+    """
+    Returns a softmax(x,y) callable bound to radius & limit.
+    """
+    return BoundSoftmax(radius, limit)
+
+def softmin_bind(radius=1.0,limit=0.01):
+    """
+    Returns a softmin(x,y) callable bound to radius & limit.
+    """
+    return BoundSoftmin(radius, limit)
+
+# Array versions of the above, for tools that sample the curves in bulk
+
+def softmax_power_array(radius,limit):
+    """
+    Elementwise softmax_power for arrays of radius and/or limit.
+    """
+    if numpy.ndim(radius) == 0 and numpy.ndim(limit) == 0:
+        return softmax_power(float(radius), float(limit))
+
+    return numpy.vectorize(softmax_power, otypes=[numpy.float64])(radius, limit)
+
+def softmaxp_array(x,y,power):
+    """
+    Elementwise softmaxp over NumPy arrays.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    return numpy.maximum(x,y) + numpy.log1p(numpy.exp(-power*numpy.abs(x-y)))/power
+
+def softmax_array(x,y,radius=1.0,limit=0.01):
+    """
+    Elementwise softmax over NumPy arrays.
+    """
+    return softmaxp_array(x,y,softmax_power_array(radius,limit))
+
+def softminp_array(x,y,power):
+    """
+    Elementwise softminp over NumPy arrays.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    return numpy.minimum(x,y) - numpy.log1p(numpy.exp(-power*numpy.abs(x-y)))/power
+
+def softmin_array(x,y,radius=1.0,limit=0.01):
+    """
+    Elementwise softmin over NumPy arrays.
+    """
+    return softminp_array(x,y,softmax_power_array(radius,limit))
+
+# Functions usable in driver expressions
+driver_functions = {
+    'softmaxp': softmaxp,
+    'softmax': softmax,
+    'softminp': softminp,
+    'softmin': softmin,
+    'softmaxn': softmaxn,
+    'softminn': softminn,
+}
+
+if numpy is not None:
+    driver_functions.update({
+        'softmaxp_array': softmaxp_array,
+        'softmax_array': softmax_array,
+        'softminp_array': softminp_array,
+        'softmin_array': softmin_array,
+    })
+
+# Profiling: counts calls, time and coefficient cache use per frame.
+#
+#   bpy.app.driver_namespace['softmax_profile'](True)
+#   ... play back ...
+#   bpy.app.driver_namespace['softmax_profile_report']()
+
+class DriverProfiler:
+    """
+    Replaces the registered driver functions with timing wrappers while enabled.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.frame = None
+        self.calls = collections.OrderedDict() # frame -> { name: [count, time] }
+        self.cache = collections.OrderedDict() # frame -> [hits, misses]
+        self.cache_mark = (0, 0)
+
+    def wrap(self, name, func):
+        calls = self.calls
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                entry = calls.setdefault(self.frame, {}).setdefault(name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += time.perf_counter() - start
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    def flush_cache(self):
+        """
+        Charges the cache hits and misses since the last mark to the current frame.
+        """
+        cache = softmax_coeff_cache
+        entry = self.cache.setdefault(self.frame, [0, 0])
+        entry[0] += cache.hits - self.cache_mark[0]
+        entry[1] += cache.misses - self.cache_mark[1]
+        self.cache_mark = (cache.hits, cache.misses)
+
+    def frame_change(self, scene):
+        self.flush_cache()
+        self.frame = scene.frame_current
+
+    def enable(self):
+        if self.enabled:
+            return
+
+        self.reset()
+        self.frame = bpy.context.scene.frame_current
+
+        for name, func in driver_functions.items():
+            bpy.app.driver_namespace[name] = self.wrap(name, func)
+
+        bpy.app.handlers.frame_change_pre.append(softmax_profile_frame_handler)
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+
+        self.flush_cache()
+        bpy.app.driver_namespace.update(driver_functions)
+        bpy.app.handlers.frame_change_pre.remove(softmax_profile_frame_handler)
+        self.enabled = False
+
+    def reset(self):
+        self.calls.clear()
+        self.cache.clear()
+        self.cache_mark = (softmax_coeff_cache.hits, softmax_coeff_cache.misses)
+
+    def report(self):
+        if self.enabled:
+            self.flush_cache()
+
+        lines = ['Frame      Calls   Time ms  Cache hit/miss']
+        totals = {}
+
+        for frame in sorted(set(self.calls) | set(self.cache), key=lambda f: (f is None, f)):
+            fcalls = self.calls.get(frame, {})
+            hits, misses = self.cache.get(frame, (0, 0))
+            count = sum(entry[0] for entry in fcalls.values())
+            ftime = sum(entry[1] for entry in fcalls.values())
+
+            if count or hits or misses:
+                lines.append('%-8s %7d %9.3f  %d/%d' % (frame, count, ftime*1000, hits, misses))
+
+            for name, entry in fcalls.items():
+                total = totals.setdefault(name, [0, 0.0])
+                total[0] += entry[0]
+                total[1] += entry[1]
+
+        lines.append('Function        Calls   Time ms  Avg us')
+
+        for name, (count, ftime) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append('%-12s %8d %9.3f %7.2f' % (name, count, ftime*1000, ftime*1e6/count))
+
+        return '\n'.join(lines)
+
+driver_profiler = DriverProfiler()
+
+@persistent
+def softmax_profile_frame_handler(scene):
+    driver_profiler.frame_change(scene)
+
+def softmax_profile(enable=True):
+    """
+    Turns profiling of the driver functions on or off.
+    """
+    if enable:
+        driver_profiler.enable()
+    else:
+        driver_profiler.disable()
+
+def softmax_profile_report(reset=False):
+    """
+    Prints and returns the per frame and per function profiling report.
+    """
+    text = driver_profiler.report()
+    print(text)
+
+    if reset:
+        driver_profiler.reset()
+    return text
+
+bpy.app.driver_namespace.update(driver_functions)
+
+# Reachable from other scripts and the Python console
+bpy.app.driver_namespace['softmax_cache_configure'] = softmax_cache_configure
+bpy.app.driver_namespace['softmax_cache_stats'] = softmax_cache_stats
+bpy.app.driver_namespace['softmax_bind'] = softmax_bind
+bpy.app.driver_namespace['softmin_bind'] = softmin_bind
+bpy.app.driver_namespace['softmax_profile'] = softmax_profile
+bpy.app.driver_namespace['softmax_profile_report'] = softmax_profile_report
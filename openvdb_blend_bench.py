@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Benchmarks openvdb_blend_smoke.bin on synthetic Blender style smoke
+# caches made by openvdb_smoke_gen.bin, and prints the results as JSON.
+#
+# Runs outside of Blender:
+#
+#   ./openvdb_blend_bench.py --resolution 128,128,128 --frames 8 > bench.json
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Mode name -> (extra blend options, use batch mode)
+MODES = {
+    'serial': (['--serial'], False),
+    'threaded': ([], False),
+    'sparse': (['--no-dense'], False),
+    'stream': (['--stream'], False),
+    'copy': (['--copy'], False),
+    'eager': (['--load', 'eager'], False),
+    'mmap': (['--load', 'mmap'], False),
+    'mmap-copy': (['--load', 'mmap', '--copy'], False),
+    'batch': ([], True),
+    'prefetch': (['--prefetch', '2'], True),
+}
+
+DEFAULT_MODES = ['serial', 'threaded', 'sparse', 'stream', 'batch', 'prefetch']
+
+def run_process(args, stdout=subprocess.DEVNULL):
+    """
+    Runs a process and returns its wall time, peak RSS in KB and exit status.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(args, stdout=stdout)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return elapsed, usage.ru_maxrss, proc.returncode
+
+def generate_inputs(opts, workdir):
+    """
+    Generates two sequences of input frames, returning the blend jobs.
+    """
+    jobs = []
+
+    for frame in range(1, opts.frames+1):
+        in1 = os.path.join(workdir, 'in1_%06d.vdb' % (frame))
+        in2 = os.path.join(workdir, 'in2_%06d.vdb' % (frame))
+        out = os.path.join(workdir, 'out_%06d.vdb' % (frame))
+
+        # With shared topology the second input only gets new values, so the
+        # leaves pair up the way consecutive frames of a real cache mostly do
+        if opts.topology == 'shared':
+            seeds = ((in1, ['--seed', str(opts.seed)]),
+                     (in2, ['--seed', str(opts.seed), '--value-seed', str(opts.seed+1)]))
+        else:
+            seeds = ((in1, ['--seed', str(opts.seed)]),
+                     (in2, ['--seed', str(opts.seed+1)]))
+
+        for fname, seed_args in seeds:
+            args = [
+                opts.gen, '--resolution', opts.resolution, '--sparsity', str(opts.sparsity),
+                '--fields', opts.fields, '--frame', str(frame)
+            ] + seed_args + [fname]
+            if subprocess.call(args) != 0:
+                raise RuntimeError('Generating %s failed' % (fname))
+
+        jobs.append((out, in1, in2, '%.4f' % (frame / (opts.frames+1))))
+
+    return jobs
+
+def file_sizes(names):
+    return sum(os.path.getsize(name) for name in names if os.path.exists(name))
+
+def run_mode(opts, mode, jobs, workdir):
+    """
+    Times one blend mode over all jobs, taking the best of the repeats.
+    """
+    extra, use_batch = MODES[mode]
+    best = None
+
+    for _ in range(opts.repeat):
+        for job in jobs:
+            if os.path.exists(job[0]):
+                os.unlink(job[0])
+
+        failed = 0
+
+        if use_batch:
+            jobfile = os.path.join(workdir, 'jobs.txt')
+
+            with open(jobfile, 'w') as f:
+                for job in jobs:
+                    f.write('\t'.join(job) + '\n')
+
+            with open(os.path.join(workdir, 'results.txt'), 'w') as f:
+                wall, rss, status = run_process([opts.blend] + extra + ['--batch', jobfile], stdout=f)
+
+            with open(os.path.join(workdir, 'results.txt')) as f:
+                failed = len([ line for line in f if not line.startswith('OK ') ])
+        else:
+            wall, rss = 0.0, 0
+
+            for job in jobs:
+                t, r, status = run_process([opts.blend] + extra + list(job))
+                wall += t
+                rss = max(rss, r)
+                failed += 1 if status != 0 else 0
+
+        result = {
+            'mode': mode,
+            'options': extra,
+            'batch': use_batch,
+            'wall_time': wall,
+            'frame_time': wall / len(jobs),
+            'peak_rss_kb': rss,
+            'output_bytes': file_sizes(job[0] for job in jobs),
+            'failed': failed,
+        }
+
+        if best is None or result['wall_time'] < best['wall_time']:
+            best = result
+
+    return best
+
+def main():
+    bindir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description='Benchmark openvdb_blend_smoke on synthetic smoke caches.')
+    parser.add_argument('--blend', default=os.path.join(bindir, 'openvdb_blend_smoke.bin'), help='blend program')
+    parser.add_argument('--gen', default=os.path.join(bindir, 'openvdb_smoke_gen.bin'), help='cache generator program')
+    parser.add_argument('--resolution', default='64,64,64', help='domain resolution as x,y,z')
+    parser.add_argument('--sparsity', type=float, default=0.5, help='fraction of the domain left inactive')
+    parser.add_argument('--fields', default='density,flame,heat,velocity,color', help='grids to generate')
+    parser.add_argument('--frames', type=int, default=4, help='number of frames to blend')
+    parser.add_argument('--seed', type=int, default=0, help='noise seed')
+    parser.add_argument('--topology', choices=['shared', 'independent'], default='shared',
+                        help='whether both inputs have the same active voxels')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per mode, the fastest is reported')
+    parser.add_argument('--modes', default=','.join(DEFAULT_MODES), help='comma separated modes: ' + ','.join(sorted(MODES)))
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--keep', action='store_true', help='keep the generated files')
+    opts = parser.parse_args()
+
+    modes = [ m for m in opts.modes.split(',') if m ]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error('unknown mode: ' + mode)
+
+    workdir = tempfile.mkdtemp(prefix='blend_bench_')
+
+    try:
+        jobs = generate_inputs(opts, workdir)
+
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {
+                'resolution': opts.resolution,
+                'sparsity': opts.sparsity,
+                'fields': opts.fields.split(','),
+                'frames': opts.frames,
+                'seed': opts.seed,
+                'topology': opts.topology,
+                'repeat': opts.repeat,
+            },
+            'input_bytes': file_sizes(name for job in jobs for name in job[1:3]),
+            'results': [ run_mode(opts, mode, jobs, workdir) for mode in modes ],
+        }
+    finally:
+        if opts.keep:
+            print('Files kept in ' + workdir, file=sys.stderr)
+        else:
+            shutil.rmtree(workdir)
+
+    text = json.dumps(report, indent=2)
+
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,35 @@
 #include <iostream>
+#include <fstream>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <set>
+#include <map>
+#include <algorithm>
+#include <deque>
+#include <memory>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <chrono>
+#include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <time.h>
+#include <getopt.h>
+#include <unistd.h>
+#include <sys/stat.h>
 
 #include <openvdb/openvdb.h>
+#include <openvdb/io/Archive.h>
+#include <openvdb/io/GridDescriptor.h>
+#include <openvdb/tree/LeafManager.h>
+#include <openvdb/tools/Prune.h>
+#include <openvdb/tools/GridTransformer.h>
+
+#include <tbb/parallel_for.h>
+#include <tbb/blocked_range.h>
 
 using namespace std;
 
@@ -14,6 +42,155 @@ using openvdb::Vec3s;
 using openvdb::FloatGrid;
 using openvdb::Vec3SGrid;
 
+using openvdb::tree::LeafManager;
+using openvdb::tree::ValueAccessor;
+
+/*
+ * How grids are read from the input files: all at once, with leaf
+ * buffers loaded on first access (the OpenVDB default, which works on
+ * a temporary copy of smaller files), or on first access straight from
+ * the memory mapped input file.
+ */
+enum LoadMode {
+    LOAD_EAGER,
+    LOAD_DELAYED,
+    LOAD_MMAP,
+};
+
+/* Settings from the command line */
+struct BlendOptions {
+    bool serial;
+    bool stream;
+    bool copy;
+    set<string> fields;
+    bool prune;
+    float prune_tolerance;
+    uint32_t compression;
+    bool recompress;
+    bool half;
+    int prefetch;
+    bool dense;
+    string telemetry;
+    string run_id;
+    bool validate;
+    LoadMode load;
+    int preview;
+
+    BlendOptions()
+        : serial(false), stream(false), copy(false), prune(false), prune_tolerance(0.0f),
+          compression(openvdb::io::Archive::DEFAULT_COMPRESSION_FLAGS), recompress(false), half(false),
+          prefetch(0), dense(true), validate(false), load(LOAD_DELAYED), preview(1) {}
+};
+
+static BlendOptions options;
+
+/*
+ * Telemetry: with --telemetry, a JSON record per grid and per frame is
+ * appended to the log, tagged with --run-id so runs can be told apart.
+ */
+typedef chrono::steady_clock Clock;
+
+double elapsed(Clock::time_point start)
+{
+    return chrono::duration<double>(Clock::now() - start).count();
+}
+
+struct GridStats {
+    string name;
+    const char *action;
+    double read_time, blend_time, write_time;
+    openvdb::Index64 active_before, active_other, active_after;
+
+    GridStats(const string &name, const char *action)
+        : name(name), action(action), read_time(0), blend_time(0), write_time(0),
+          active_before(0), active_other(0), active_after(0) {}
+};
+
+struct FrameStats {
+    double read_time, blend_time, write_time;
+    vector<GridStats> grids;
+
+    FrameStats() : read_time(0), blend_time(0), write_time(0) {}
+};
+
+static ofstream telemetry;
+static mutex telemetry_lock;
+
+bool telemetry_enabled()
+{
+    return telemetry.is_open();
+}
+
+string json_string(const string &str)
+{
+    ostringstream out;
+
+    out << '"';
+
+    for (size_t i = 0; i < str.size(); i++) {
+        unsigned char c = str[i];
+
+        if (c == '"' || c == '\\')
+            out << '\\' << c;
+        else if (c < 0x20) {
+            char buf[8];
+            snprintf(buf, sizeof(buf), "\\u%04x", c);
+            out << buf;
+        }
+        else
+            out << c;
+    }
+
+    out << '"';
+    return out.str();
+}
+
+openvdb::Index64 file_size(const string &filename)
+{
+    struct stat st;
+
+    return stat(filename.c_str(), &st) == 0 ? st.st_size : 0;
+}
+
+void log_frame(const string &fn_out, const string &fn_in1, const string &fn_in2, float coeff,
+               bool ok, const FrameStats &stats)
+{
+    if (!telemetry_enabled())
+        return;
+
+    ostringstream rec;
+    openvdb::Index64 active_before = 0, active_after = 0;
+    string prefix = "{\"run\":" + json_string(options.run_id) + ",\"output\":" + json_string(fn_out);
+
+    for (size_t i = 0; i < stats.grids.size(); i++) {
+        const GridStats &gs = stats.grids[i];
+
+        active_before += gs.active_before;
+        active_after += gs.active_after;
+
+        rec << prefix << ",\"event\":\"grid\",\"grid\":" << json_string(gs.name)
+            << ",\"action\":\"" << gs.action << "\""
+            << ",\"read_time\":" << gs.read_time << ",\"blend_time\":" << gs.blend_time
+            << ",\"write_time\":" << gs.write_time
+            << ",\"active_before\":" << gs.active_before << ",\"active_other\":" << gs.active_other
+            << ",\"active_after\":" << gs.active_after << "}\n";
+    }
+
+    rec << prefix << ",\"event\":\"frame\",\"status\":\"" << (ok ? "blended" : "failed") << "\""
+        << ",\"inputs\":[" << json_string(fn_in1) << "," << json_string(fn_in2) << "]"
+        << ",\"factor\":" << coeff
+        << ",\"read_time\":" << stats.read_time << ",\"blend_time\":" << stats.blend_time
+        << ",\"write_time\":" << stats.write_time
+        << ",\"active_before\":" << active_before << ",\"active_after\":" << active_after
+        << ",\"input_bytes\":" << file_size(fn_in1) + file_size(fn_in2)
+        << ",\"output_bytes\":" << (ok ? file_size(fn_out) : 0) << "}\n";
+
+    /* One write per frame, so that concurrent processes can share the log */
+    lock_guard<mutex> guard(telemetry_lock);
+
+    telemetry << rec.str() << flush;
+}
+
 template<class T>
 bool verify_metadata_match(MetaMap::Ptr metadata1, MetaMap::Ptr metadata2, const char *name)
 {
@@ -52,6 +229,207 @@ struct BlendOp {
 };
 #endif
 
+/*
+ * Blends the active voxels of tree1 leaves with the matching tree2 values.
+ * With dense set, a leaf whose tree2 counterpart has the same active mask
+ * (most leaves of consecutive smoke frames) is blended as a flat array,
+ * without accessor lookups; the values are computed the same way.
+ */
+template<class TREE>
+struct BlendLeafOp {
+    typedef typename LeafManager<TREE>::LeafRange LeafRange;
+    typedef typename TREE::LeafNodeType LeafType;
+    typedef typename TREE::ValueType ValueType;
+
+    const TREE &tree2;
+    float coeff;
+    bool dense;
+
+    BlendLeafOp(const TREE &tree2, float coeff, bool dense) : tree2(tree2), coeff(coeff), dense(dense) {}
+
+    void blend_flat(LeafType &leaf1, const LeafType &leaf2) const {
+        ValueType *__restrict__ a = leaf1.buffer().data();
+        const ValueType *__restrict__ b = leaf2.buffer().data();
+
+        if (leaf1.getValueMask().isOn()) {
+            for (openvdb::Index n = 0; n < LeafType::SIZE; n++)
+                a[n] = a[n] * (1.0f - coeff) + b[n] * coeff;
+        }
+        else {
+            for (typename LeafType::NodeMaskType::OnIterator iter = leaf1.getValueMask().beginOn(); iter; ++iter)
+                a[iter.pos()] = a[iter.pos()] * (1.0f - coeff) + b[iter.pos()] * coeff;
+        }
+    }
+
+    void operator() (const LeafRange &range) const {
+        ValueAccessor<const TREE> acc2(tree2);
+
+        for (typename LeafRange::Iterator leaf = range.begin(); leaf; ++leaf) {
+            const LeafType *leaf2 = dense ? acc2.probeConstLeaf(leaf->origin()) : NULL;
+
+            if (leaf2 && leaf2->getValueMask() == leaf->getValueMask()) {
+                blend_flat(*leaf, *leaf2);
+                continue;
+            }
+
+            for (typename LeafType::ValueOnIter iter = leaf->beginValueOn(); iter; ++iter) {
+                typename TREE::ValueType a = iter.getValue(), b = acc2.getValue(iter.getCoord());
+
+                iter.setValue(a * (1.0f - coeff) + b * coeff);
+            }
+        }
+    }
+};
+
+/* Finds the active voxels of tree2 leaves that are not active in tree1 */
+template<class TREE>
+struct FindMissingOp {
+    typedef typename LeafManager<const TREE>::LeafRange LeafRange;
+    typedef typename TREE::LeafNodeType LeafType;
+    typedef typename LeafType::NodeMaskType MaskType;
+
+    const TREE &tree1;
+    vector<MaskType> &masks;
+
+    FindMissingOp(const TREE &tree1, vector<MaskType> &masks) : tree1(tree1), masks(masks) {}
+
+    void operator() (const LeafRange &range) const {
+        ValueAccessor<const TREE> acc1(tree1);
+
+        for (typename LeafRange::Iterator leaf = range.begin(); leaf; ++leaf) {
+            MaskType &mask = masks[leaf.pos()];
+            const LeafType *leaf1 = acc1.probeConstLeaf(leaf->origin());
+
+            if (leaf1) {
+                mask = leaf->getValueMask() & !leaf1->getValueMask();
+                continue;
+            }
+
+            for (typename LeafType::ValueOnCIter iter = leaf->cbeginValueOn(); iter; ++iter) {
+                if (!acc1.isValueOn(iter.getCoord()))
+                    mask.setOn(iter.pos());
+            }
+        }
+    }
+};
+
+/* Copies the scaled tree2 values selected by the masks into tree1 leaves */
+template<class TREE>
+struct AddMissingOp {
+    typedef typename TREE::LeafNodeType LeafType;
+    typedef typename LeafType::NodeMaskType MaskType;
+    typedef std::pair<LeafType*, const LeafType*> LeafPair;
+
+    const vector<LeafPair> &leaves;
+    const vector<const MaskType*> &masks;
+    float coeff;
+
+    AddMissingOp(const vector<LeafPair> &leaves, const vector<const MaskType*> &masks, float coeff)
+        : leaves(leaves), masks(masks), coeff(coeff) {}
+
+    void operator() (const tbb::blocked_range<size_t> &range) const {
+        for (size_t i = range.begin(); i != range.end(); ++i) {
+            LeafType *leaf1 = leaves[i].first;
+            const LeafType *leaf2 = leaves[i].second;
+
+            for (typename MaskType::OnIterator iter = masks[i]->beginOn(); iter; ++iter)
+                leaf1->setValueOn(iter.pos(), leaf2->getValue(iter.pos()) * coeff);
+        }
+    }
+};
+
+inline float value_magnitude(float value) { return fabsf(value); }
+inline float value_magnitude(const Vec3s &value) { return value.length(); }
+
+/* Deactivates the voxels with a magnitude at or below the tolerance */
+template<class TREE>
+struct PruneLeafOp {
+    typedef typename LeafManager<TREE>::LeafRange LeafRange;
+    typedef typename TREE::LeafNodeType LeafType;
+
+    typename TREE::ValueType background;
+    float tolerance;
+
+    PruneLeafOp(const typename TREE::ValueType &background, float tolerance)
+        : background(background), tolerance(tolerance) {}
+
+    void operator() (const LeafRange &range) const {
+        for (typename LeafRange::Iterator leaf = range.begin(); leaf; ++leaf) {
+            for (typename LeafType::ValueOnIter iter = leaf->beginValueOn(); iter; ++iter) {
+                if (value_magnitude(iter.getValue()) <= tolerance)
+                    leaf->setValueOff(iter.pos(), background);
+            }
+        }
+    }
+};
+
+/* Applies the output options to a blended grid */
+template<class GRID>
+void finish_grid(typename GRID::Ptr grid)
+{
+    if (options.prune) {
+        typename GRID::TreeType &tree = grid->tree();
+
+        {
+            LeafManager<typename GRID::TreeType> leaves(tree);
+
+            tbb::parallel_for(leaves.leafRange(),
+                              PruneLeafOp<typename GRID::TreeType>(tree.background(), options.prune_tolerance));
+        }
+
+        openvdb::tools::pruneInactive(tree);
+    }
+
+    grid->addStatsMetadata();
+}
+
+/*
+ * Leaf parallel version of the serial loops below. Voxel values are
+ * computed with the same expressions, so the result is bit-identical.
+ */
+template<class GRID>
+void blend_grids_threaded(typename GRID::Ptr grid1, typename GRID::Ptr grid2, float coeff)
+{
+    typedef typename GRID::TreeType TreeType;
+    typedef typename TreeType::LeafNodeType LeafType;
+    typedef typename LeafType::NodeMaskType MaskType;
+    typedef typename AddMissingOp<TreeType>::LeafPair LeafPair;
+
+    TreeType &tree1 = grid1->tree();
+    const TreeType &tree2 = grid2->tree();
+
+    /* Find grid2-only voxels before tree1 is touched */
+    LeafManager<const TreeType> leaves2(tree2);
+    vector<MaskType> masks(leaves2.leafCount());
+
+    tbb::parallel_for(leaves2.leafRange(), FindMissingOp<TreeType>(tree1, masks));
+
+    /* Blend the existing voxels; the topology doesn't change here */
+    {
+        LeafManager<TreeType> leaves1(tree1);
+
+        tbb::parallel_for(leaves1.leafRange(), BlendLeafOp<TreeType>(tree2, coeff, options.dense));
+    }
+
+    /* Allocate the missing leaves serially, then fill them in parallel */
+    typename GRID::Accessor acc1 = grid1->getAccessor();
+    vector<LeafPair> pairs;
+    vector<const MaskType*> pair_masks;
+
+    for (size_t i = 0; i < masks.size(); i++) {
+        if (masks[i].isOff())
+            continue;
+
+        const LeafType &leaf2 = leaves2.leaf(i);
+
+        pairs.push_back(LeafPair(acc1.touchLeaf(leaf2.origin()), &leaf2));
+        pair_masks.push_back(&masks[i]);
+    }
+
+    tbb::parallel_for(tbb::blocked_range<size_t>(0, pairs.size()),
+                      AddMissingOp<TreeType>(pairs, pair_masks, coeff));
+}
+
 template<class GRID>
 void blend_grids(GridBase::Ptr pgrid1, GridBase::Ptr pgrid2, float coeff)
 {
@@ -61,6 +439,13 @@ void blend_grids(GridBase::Ptr pgrid1, GridBase::Ptr pgrid2, float coeff)
     if (!grid1 || !grid2)
         return;
 
+    if (!options.serial) {
+        blend_grids_threaded<GRID>(grid1, grid2, coeff);
+
+        finish_grid<GRID>(grid1);
+        return;
+    }
+
 #if 0
     typename GRID::TreeType &tree1 = grid1->tree();
     typename GRID::TreeType &tree2 = grid2->tree();
@@ -88,82 +473,1036 @@ void blend_grids(GridBase::Ptr pgrid1, GridBase::Ptr pgrid2, float coeff)
             acc1.setValueOn(iter.getCoord(), iter.getValue() * coeff);
     }
 
-    grid1->addStatsMetadata();
+    finish_grid<GRID>(grid1);
 #endif
 }
 
-int main(int argc, const char *argv[])
+void blend_grid_pair(GridBase::Ptr grid1, GridBase::Ptr grid2, float coeff, GridStats &gs)
 {
-    openvdb::initialize();
+    bool counting = telemetry_enabled();
 
-    if (argc < 1+3+1) {
-        cerr << "Usage: openvdb_blend_smoke <outfile> <infile1> <infile2> <coeff>" << endl;
-        return 1;
+    if (counting) {
+        gs.active_before = grid1->activeVoxelCount();
+        gs.active_other = grid2->activeVoxelCount();
     }
 
-    const char *fn_out = argv[1];
-    const char *fn_in1 = argv[2];
-    const char *fn_in2 = argv[3];
-    float coeff = (float)atof(argv[4]);
+    Clock::time_point start = Clock::now();
 
-    /* Open input files */
-    openvdb::io::File infile1(fn_in1);
-    openvdb::io::File infile2(fn_in2);
+    if (grid1->isType<FloatGrid>()) {
+        blend_grids<FloatGrid>(grid1, grid2, coeff);
+    }
+    else if (grid1->isType<Vec3SGrid>()) {
+        blend_grids<Vec3SGrid>(grid1, grid2, coeff);
+    }
 
-    try {
-        infile1.open();
-    } catch (openvdb::IoError&) {
-        cerr << "Could not open " << fn_in1 << endl;
-        return 1;
+    gs.blend_time = elapsed(start);
+
+    if (counting)
+        gs.active_after = grid1->activeVoxelCount();
+}
+
+/* Records a grid that is written unchanged */
+GridStats &pass_stats(FrameStats &stats, const GridBase &grid, const char *action)
+{
+    stats.grids.push_back(GridStats(grid.getName(), action));
+
+    GridStats &gs = stats.grids.back();
+
+    if (telemetry_enabled() && strcmp(action, "copy") != 0)
+        gs.active_before = gs.active_after = grid.activeVoxelCount();
+
+    return gs;
+}
+
+/*
+ * Resamples a grid to voxels factor times as large. Coarse voxel j is
+ * centered on the fine voxels factor*j to factor*j+factor-1, so index
+ * space shrinks the same way as the resolution in the smoke metadata.
+ */
+template<class GRID>
+GridBase::Ptr downsample_grid(const GRID &grid, int factor)
+{
+    openvdb::math::Transform::Ptr xform = grid.transform().copy();
+
+    xform->preTranslate(openvdb::Vec3d(0.5 * (factor - 1)));
+    xform->preScale(factor);
+
+    typename GRID::Ptr result = GRID::create(grid.background());
+
+    result->insertMeta(grid);
+    result->setTransform(xform);
+
+    /* Reduces in halving steps with box filtering, so 4x doesn't alias */
+    openvdb::tools::resampleToMatch<openvdb::tools::BoxSampler>(grid, *result);
+
+    result->addStatsMetadata();
+    return result;
+}
+
+/* Scales a resolution in the smoke metadata down by the preview factor */
+inline int preview_floor(int value) { return (int)floor((double)value / options.preview); }
+inline int preview_ceil(int value) { return (int)ceil((double)value / options.preview); }
+
+/*
+ * Returns the file metadata to write, adjusted for --preview. Blender only
+ * accepts a cache of different resolution for adaptive domains.
+ */
+MetaMap::Ptr prepare_metadata(MetaMap::Ptr metadata)
+{
+    if (options.preview <= 1)
+        return metadata;
+
+    MetaMap::Ptr result = metadata->copyMeta();
+    Vec3i res = result->metaValue<Vec3i>("blender/smoke/resolution");
+    Vec3i new_res, new_min(0, 0, 0);
+
+    for (int i = 0; i < 3; i++)
+        new_res[i] = preview_ceil(res[i]);
+
+    result->insertMeta("blender/smoke/resolution", openvdb::Vec3IMetadata(new_res));
+
+    /* Per cell values: the domain offset in cells and the cell size */
+    Vec3i shift = result->metaValue<Vec3i>("blender/smoke/shift"), new_shift;
+
+    for (int i = 0; i < 3; i++)
+        new_shift[i] = preview_floor(shift[i]);
+
+    result->insertMeta("blender/smoke/shift", openvdb::Vec3IMetadata(new_shift));
+
+    if (openvdb::FloatMetadata::Ptr dx = result->getMetadata<openvdb::FloatMetadata>("blender/smoke/dx"))
+        result->insertMeta("blender/smoke/dx", openvdb::FloatMetadata(dx->value() * options.preview));
+
+    /* Adaptive domains also store the bounds of the resolution */
+    if (openvdb::Vec3IMetadata::Ptr res_min = result->getMetadata<openvdb::Vec3IMetadata>("blender/smoke/min_resolution")) {
+        for (int i = 0; i < 3; i++)
+            new_min[i] = preview_floor(res_min->value()[i]);
+
+        result->insertMeta("blender/smoke/min_resolution", openvdb::Vec3IMetadata(new_min));
+    }
+
+    if (result->getMetadata<openvdb::Vec3IMetadata>("blender/smoke/max_resolution"))
+        result->insertMeta("blender/smoke/max_resolution", openvdb::Vec3IMetadata(new_min + new_res));
+
+    if (openvdb::Vec3IMetadata::Ptr base = result->getMetadata<openvdb::Vec3IMetadata>("blender/smoke/base_resolution")) {
+        Vec3i new_base;
+
+        for (int i = 0; i < 3; i++)
+            new_base[i] = preview_ceil(base->value()[i]);
+
+        result->insertMeta("blender/smoke/base_resolution", openvdb::Vec3IMetadata(new_base));
+    }
+
+    return result;
+}
+
+/* Applies the storage options to a grid about to be written */
+GridBase::Ptr prepare_output(GridBase::Ptr grid)
+{
+    if (options.preview > 1) {
+        if (grid->isType<FloatGrid>())
+            grid = downsample_grid(*openvdb::gridPtrCast<FloatGrid>(grid), options.preview);
+        else if (grid->isType<Vec3SGrid>())
+            grid = downsample_grid(*openvdb::gridPtrCast<Vec3SGrid>(grid), options.preview);
+    }
+
+    if (options.half)
+        grid->setSaveFloatAsHalf(true);
+
+    return grid;
+}
+
+/*
+ * A job with the same file as both inputs only converts that file, which
+ * the driver uses to apply --preview to frames outside the blend window
+ */
+bool is_conversion(const string &fn_in1, const string &fn_in2)
+{
+    return fn_in1 == fn_in2;
+}
+
+/* Checks if the grid is of a blended type and selected by --fields */
+bool should_blend(const GridBase &grid)
+{
+    if (!grid.isType<FloatGrid>() && !grid.isType<Vec3SGrid>())
+        return false;
+
+    return options.fields.empty() || options.fields.count(grid.getName()) > 0;
+}
+
+/*
+ * Locates the grid records of a VDB file, so that they can be copied
+ * to the output byte for byte. Only files written with the current
+ * format version qualify, since the records are self-contained only
+ * within the same version.
+ */
+class RawGridSource : public openvdb::io::Archive {
+    ifstream is;
+    map<string, openvdb::io::GridDescriptor> descriptors;
+
+public:
+    bool open(const char *filename) {
+        is.open(filename, ios_base::in | ios_base::binary);
+
+        if (!is)
+            return false;
+
+        try {
+            readHeader(is);
+        } catch (openvdb::IoError&) {
+            return false;
+        }
+
+        if (fileVersion() != OPENVDB_FILE_VERSION || !inputHasGridOffsets())
+            return false;
+
+        openvdb::io::setVersion(is, libraryVersion(), fileVersion());
+
+        MetaMap metadata;
+        int32_t grid_count = 0;
+
+        metadata.readMeta(is);
+        is.read(reinterpret_cast<char*>(&grid_count), sizeof(int32_t));
+
+        for (int32_t i = 0; i < grid_count; i++) {
+            openvdb::io::GridDescriptor gd;
+
+            gd.read(is);
+            gd.seekToEnd(is);
+
+            if (!gd.isInstance() && !descriptors.count(gd.gridName()))
+                descriptors[gd.gridName()] = gd;
+        }
+
+        return bool(is);
+    }
+
+    const openvdb::io::GridDescriptor *find(const string &name) const {
+        map<string, openvdb::io::GridDescriptor>::const_iterator it = descriptors.find(name);
+
+        return it != descriptors.end() ? &it->second : NULL;
+    }
+
+    istream &stream() { return is; }
+};
+
+/*
+ * Writes a VDB file one grid at a time, using the same layout as
+ * io::File::write, so that blended grids can be released early.
+ */
+class StreamingArchive : public openvdb::io::Archive {
+    ofstream os;
+    set<string> names;
+
+public:
+    bool open(const char *filename, const MetaMap &metadata, int32_t grid_count) {
+        os.open(filename, ios_base::out | ios_base::binary | ios_base::trunc);
+
+        if (!os) {
+            cerr << "Could not create " << filename << endl;
+            return false;
+        }
+
+        openvdb::io::setDataCompression(os, compression());
+        openvdb::io::setWriteGridStatsMetadata(os, isGridStatsMetadataEnabled());
+
+        writeHeader(os, /*seekable=*/true);
+        metadata.writeMeta(os);
+        os.write(reinterpret_cast<char*>(&grid_count), sizeof(int32_t));
+        return true;
+    }
+
+    void add_grid(GridBase::ConstPtr grid) {
+        string name = grid->getName();
+
+        if (name.empty())
+            name = openvdb::io::GridDescriptor::addSuffix(name, 0);
+        for (int n = 1; names.count(name); ++n)
+            name = openvdb::io::GridDescriptor::addSuffix(grid->getName(), n);
+
+        names.insert(name);
+
+        openvdb::io::GridDescriptor gd(name, grid->type(), grid->saveFloatAsHalf());
+
+        writeGrid(gd, grid, os, /*seekable=*/true);
+        openvdb::io::setDataCompression(os, compression());
+    }
+
+    /* Copies a grid record without decoding it, fixing up the stream positions */
+    void add_raw_grid(const openvdb::io::GridDescriptor &src, istream &is) {
+        openvdb::io::GridDescriptor gd(src.uniqueName(), src.gridType(), src.saveFloatAsHalf());
+
+        names.insert(src.uniqueName());
+
+        gd.writeHeader(os);
+
+        int64_t offset_pos = os.tellp();
+        gd.writeStreamPos(os);
+
+        int64_t grid_pos = os.tellp();
+        int64_t size = src.getEndPos() - src.getGridPos();
+        vector<char> buffer(1 << 20);
+
+        is.clear();
+        is.seekg(src.getGridPos(), ios_base::beg);
+
+        while (size > 0) {
+            streamsize chunk = (streamsize)min<int64_t>(size, buffer.size());
+
+            if (!is.read(&buffer[0], chunk))
+                OPENVDB_THROW(openvdb::IoError, "short read copying grid " + src.gridName());
+
+            os.write(&buffer[0], chunk);
+            size -= chunk;
+        }
+
+        gd.setGridPos(grid_pos);
+        gd.setBlockPos(grid_pos + (src.getBlockPos() - src.getGridPos()));
+        gd.setEndPos(os.tellp());
+
+        os.seekp(offset_pos, ios_base::beg);
+        gd.writeStreamPos(os);
+        gd.seekToEnd(os);
+    }
+
+    void close() {
+        os.close();
     }
+};
+
+/* Reads, blends and writes one grid pair at a time */
+bool blend_files_streaming(openvdb::io::File &infile1, openvdb::io::File &infile2, MetaMap::Ptr metadata1,
+                           const char *fn_in1, const char *fn_out, float coeff, bool convert, FrameStats &stats)
+{
+    openvdb::GridPtrVecPtr headers = infile1.readAllGridMetadata();
+
+    for (unsigned i = 0; i < headers->size(); i++) {
+        const GridBase &header = *(*headers)[i];
+
+        if (!convert && should_blend(header) && !infile2.hasGrid(header.getName())) {
+            cerr << "Cannot find second grid " << header.getName() << endl;
+            return false;
+        }
+    }
+
+    /*
+     * Raw records keep the codec and precision of the input and can't be
+     * resampled, so -z, --half and --preview decode every grid instead
+     */
+    RawGridSource raw_source;
+    bool use_raw = options.copy && !options.recompress && !options.half && options.preview <= 1
+                   && raw_source.open(fn_in1);
+
+    StreamingArchive outfile;
+
+    outfile.setCompression(options.compression);
+
+    if (!outfile.open(fn_out, *prepare_metadata(metadata1), (int32_t)headers->size()))
+        return false;
+
+    for (unsigned i = 0; i < headers->size(); i++) {
+        const GridBase &header = *(*headers)[i];
+        const string &name = header.getName();
+
+        if (convert || !should_blend(header)) {
+            const openvdb::io::GridDescriptor *gd = use_raw ? raw_source.find(name) : NULL;
+            Clock::time_point start = Clock::now();
+
+            if (gd) {
+                outfile.add_raw_grid(*gd, raw_source.stream());
+                pass_stats(stats, header, "copy").write_time = elapsed(start);
+            }
+            else {
+                GridBase::Ptr grid = infile1.readGrid(name);
+                GridStats &gs = pass_stats(stats, *grid, "pass");
+
+                gs.read_time = elapsed(start);
+                start = Clock::now();
+                outfile.add_grid(prepare_output(grid));
+                gs.write_time = elapsed(start);
+            }
+
+            continue;
+        }
+
+        stats.grids.push_back(GridStats(name, "blend"));
+
+        GridStats &gs = stats.grids.back();
+        Clock::time_point start = Clock::now();
+
+        GridBase::Ptr grid1 = infile1.readGrid(name);
+        GridBase::Ptr grid2 = infile2.readGrid(name);
+
+        gs.read_time = elapsed(start);
+
+        blend_grid_pair(grid1, grid2, coeff, gs);
+        grid2.reset();
+
+        start = Clock::now();
+        outfile.add_grid(prepare_output(grid1));
+        gs.write_time = elapsed(start);
+    }
+
+    for (size_t i = 0; i < stats.grids.size(); i++) {
+        stats.read_time += stats.grids[i].read_time;
+        stats.blend_time += stats.grids[i].blend_time;
+        stats.write_time += stats.grids[i].write_time;
+    }
+
+    outfile.close();
+    return true;
+}
+
+bool open_input(openvdb::io::File &infile, LoadMode mode)
+{
+    /* By default OpenVDB maps a private copy of files below a size limit */
+    if (mode == LOAD_MMAP)
+        infile.setCopyMaxBytes(0);
 
     try {
-        infile2.open();
+        infile.open(mode != LOAD_EAGER);
     } catch (openvdb::IoError&) {
-        cerr << "Could not open " << fn_in2 << endl;
-        return 1;
+        cerr << "Could not open " << infile.filename() << endl;
+        return false;
     }
 
+    return true;
+}
+
+/* Opens both input files and checks that their smoke metadata matches */
+bool open_inputs(openvdb::io::File &infile1, openvdb::io::File &infile2, LoadMode mode)
+{
+    if (!open_input(infile1, mode) || !open_input(infile2, mode))
+        return false;
+
     /* Check metadata */
     MetaMap::Ptr metadata1 = infile1.getMetadata();
     MetaMap::Ptr metadata2 = infile2.getMetadata();
 
     if (!verify_metadata_match<Vec3i>(metadata1, metadata2, "blender/smoke/resolution"))
-        return 1;
+        return false;
     if (!verify_metadata_match<Vec3i>(metadata1, metadata2, "blender/smoke/shift"))
-        return 1;
+        return false;
     if (!verify_metadata_match<int>(metadata1, metadata2, "blender/smoke/fluid_fields"))
-        return 1;
+        return false;
     if (!verify_metadata_match<int>(metadata1, metadata2, "blender/smoke/active_fields"))
-        return 1;
+        return false;
+
+    return true;
+}
+
+void write_grids(const char *fn_out, openvdb::GridPtrVecPtr grids, MetaMap::Ptr metadata)
+{
+    openvdb::io::File outfile(fn_out);
+
+    for (unsigned i = 0; i < grids->size(); i++)
+        (*grids)[i] = prepare_output((*grids)[i]);
+
+    outfile.setCompression(options.compression);
+    outfile.write(*grids, *prepare_metadata(metadata));
+    outfile.close();
+}
+
+/* Blend two cache files into the output file, returning false on failure */
+bool blend_files(const char *fn_out, const char *fn_in1, const char *fn_in2, float coeff, FrameStats &stats)
+{
+    /* Open input files */
+    openvdb::io::File infile1(fn_in1);
+    openvdb::io::File infile2(fn_in2);
+
+    if (!open_inputs(infile1, infile2, options.load))
+        return false;
+
+    MetaMap::Ptr metadata1 = infile1.getMetadata();
+    bool convert = is_conversion(fn_in1, fn_in2);
+
+    if (options.stream || options.copy)
+        return blend_files_streaming(infile1, infile2, metadata1, fn_in1, fn_out, coeff, convert, stats);
 
     /* Read grids */
+    Clock::time_point start = Clock::now();
     openvdb::GridPtrVecPtr grids = infile1.getGrids();
 
+    stats.read_time += elapsed(start);
+
     for (unsigned i = 0; i < grids->size(); i++)
     {
         openvdb::GridBase::Ptr grid1 = (*grids)[i];
 
+        if (convert || !should_blend(*grid1)) {
+            pass_stats(stats, *grid1, "pass");
+            continue;
+        }
+
         if (!infile2.hasGrid(grid1->getName())) {
             cerr << "Cannot find second grid " << grid1->getName() << endl;
-            return 1;
+            return false;
         }
 
+        stats.grids.push_back(GridStats(grid1->getName(), "blend"));
+
+        GridStats &gs = stats.grids.back();
+
+        start = Clock::now();
         openvdb::GridBase::Ptr grid2 = infile2.readGrid(grid1->getName());
+        gs.read_time = elapsed(start);
+
+        blend_grid_pair(grid1, grid2, coeff, gs);
+
+        stats.read_time += gs.read_time;
+        stats.blend_time += gs.blend_time;
+    }
+
+    /* Write output */
+    start = Clock::now();
+    write_grids(fn_out, grids, metadata1);
+    stats.write_time = elapsed(start);
 
-        if (grid1->isType<FloatGrid>()) {
-            blend_grids<FloatGrid>(grid1, grid2, coeff);
+    return true;
+}
+
+/* Checks a job using only the file headers and grid metadata, without reading any voxels */
+bool validate_files(const char *fn_in1, const char *fn_in2)
+{
+    openvdb::io::File infile1(fn_in1);
+    openvdb::io::File infile2(fn_in2);
+
+    /* Eager mode only reads the headers here, and never copies the files */
+    if (!open_inputs(infile1, infile2, LOAD_EAGER))
+        return false;
+
+    openvdb::GridPtrVecPtr headers1 = infile1.readAllGridMetadata();
+    openvdb::GridPtrVecPtr headers2 = infile2.readAllGridMetadata();
+    map<string, string> types2;
+    bool ok = true;
+
+    for (unsigned i = 0; i < headers2->size(); i++)
+        types2[(*headers2)[i]->getName()] = (*headers2)[i]->type();
+
+    for (unsigned i = 0; i < headers1->size(); i++) {
+        const GridBase &header = *(*headers1)[i];
+
+        if (!should_blend(header))
+            continue;
+
+        map<string, string>::const_iterator it = types2.find(header.getName());
+
+        if (it == types2.end()) {
+            cerr << "Cannot find second grid " << header.getName() << endl;
+            ok = false;
         }
-        else if (grid1->isType<Vec3SGrid>()) {
-            blend_grids<Vec3SGrid>(grid1, grid2, coeff);
+        else if (it->second != header.type()) {
+            cerr << "Type mismatch in grid " << header.getName() << endl;
+            ok = false;
         }
     }
 
-    /* Write output */
-    openvdb::io::File outfile(fn_out);
+    return ok;
+}
 
-    outfile.write(*grids, *metadata1);
-    outfile.close();
+/* Run one job, making sure errors don't escape into the batch loop */
+bool run_job(const char *fn_out, const char *fn_in1, const char *fn_in2, float coeff)
+{
+    FrameStats stats;
+    bool ok = false;
+
+    try {
+        if (options.validate)
+            ok = validate_files(fn_in1, fn_in2);
+        else
+            ok = blend_files(fn_out, fn_in1, fn_in2, coeff, stats);
+    }
+    catch (openvdb::Exception& e) {
+        cerr << "Error blending " << fn_out << ": " << e.what() << endl;
+    }
+    catch (std::exception& e) {
+        cerr << "Error blending " << fn_out << ": " << e.what() << endl;
+    }
+
+    if (!options.validate)
+        log_frame(fn_out, fn_in1, fn_in2, coeff, ok, stats);
+    else if (!ok)
+        cerr << "Invalid job " << fn_out << endl;
+
+    return ok;
+}
+
+/*
+ * Batch mode: every line of the job list is a tab separated
+ * "outfile infile1 infile2 coeff" tuple. The result of each job
+ * is reported on stdout as "OK <outfile>" or "FAILED <outfile>".
+ */
+bool split_job_line(const string &line, vector<string> &fields)
+{
+    istringstream ss(line);
+    string field;
+
+    fields.clear();
+
+    while (getline(ss, field, '\t'))
+        fields.push_back(field);
+
+    return fields.size() == 4;
+}
+
+int run_batch(istream &in)
+{
+    string line;
+    vector<string> fields;
+    int failed = 0;
+
+    while (getline(in, line)) {
+        if (line.empty() || line[0] == '#')
+            continue;
+
+        bool ok = false;
+
+        if (split_job_line(line, fields)) {
+            float coeff = (float)atof(fields[3].c_str());
+
+            ok = run_job(fields[0].c_str(), fields[1].c_str(), fields[2].c_str(), coeff);
+        }
+        else {
+            cerr << "Invalid job: " << line << endl;
+        }
+
+        if (!ok)
+            failed++;
+
+        cout << (ok ? "OK " : "FAILED ") << (fields.empty() ? line : fields[0]) << endl;
+    }
+
+    return failed ? 1 : 0;
+}
+
+/*
+ * Pipelined batch mode: a reader thread loads the inputs of upcoming
+ * frames and a writer thread saves finished ones, while the main thread
+ * blends. The queues between the stages hold at most --prefetch frames.
+ */
+struct FrameData {
+    string fn_out, fn_in1, fn_in2;
+    float coeff;
+    bool ok;
+
+    MetaMap::Ptr metadata;
+    openvdb::GridPtrVecPtr grids1;
+    openvdb::GridPtrVec grids2;
+
+    FrameStats stats;
+
+    FrameData() : coeff(0.0f), ok(false) {}
+};
+
+typedef std::shared_ptr<FrameData> FramePtr;
+
+template<class T>
+class BoundedQueue {
+    deque<T> items;
+    size_t limit;
+    bool closed;
+    mutex lock;
+    condition_variable not_empty, not_full;
+
+public:
+    BoundedQueue(size_t limit) : limit(limit), closed(false) {}
+
+    void push(const T &item) {
+        unique_lock<mutex> guard(lock);
+
+        not_full.wait(guard, [this] { return items.size() < limit; });
+        items.push_back(item);
+        not_empty.notify_one();
+    }
+
+    /* Returns false once the queue is closed and drained */
+    bool pop(T &item) {
+        unique_lock<mutex> guard(lock);
+
+        not_empty.wait(guard, [this] { return closed || !items.empty(); });
+
+        if (items.empty())
+            return false;
+
+        item = items.front();
+        items.pop_front();
+        not_full.notify_one();
+        return true;
+    }
+
+    void close() {
+        lock_guard<mutex> guard(lock);
+
+        closed = true;
+        not_empty.notify_all();
+    }
+};
+
+/* Loads all grid data of the frame, so that blending doesn't wait for I/O */
+bool read_frame(FrameData &frame)
+{
+    openvdb::io::File infile1(frame.fn_in1);
+    openvdb::io::File infile2(frame.fn_in2);
+
+    Clock::time_point start = Clock::now();
+
+    if (!open_inputs(infile1, infile2, LOAD_EAGER))
+        return false;
+
+    frame.metadata = infile1.getMetadata();
+    frame.grids1 = infile1.getGrids();
+    frame.grids2.assign(frame.grids1->size(), GridBase::Ptr());
+
+    bool convert = is_conversion(frame.fn_in1, frame.fn_in2);
+
+    for (unsigned i = 0; i < frame.grids1->size(); i++) {
+        const GridBase &grid1 = *(*frame.grids1)[i];
+
+        if (convert || !should_blend(grid1))
+            continue;
+
+        if (!infile2.hasGrid(grid1.getName())) {
+            cerr << "Cannot find second grid " << grid1.getName() << endl;
+            return false;
+        }
+
+        frame.grids2[i] = infile2.readGrid(grid1.getName());
+    }
+
+    frame.stats.read_time = elapsed(start);
+    return true;
+}
+
+bool blend_frame(FrameData &frame)
+{
+    for (unsigned i = 0; i < frame.grids1->size(); i++) {
+        GridBase::Ptr grid1 = (*frame.grids1)[i];
+
+        if (frame.grids2[i]) {
+            frame.stats.grids.push_back(GridStats(grid1->getName(), "blend"));
+            blend_grid_pair(grid1, frame.grids2[i], frame.coeff, frame.stats.grids.back());
+            frame.stats.blend_time += frame.stats.grids.back().blend_time;
+            frame.grids2[i].reset();
+        }
+        else
+            pass_stats(frame.stats, *grid1, "pass");
+    }
+
+    return true;
+}
+
+bool write_frame(FrameData &frame)
+{
+    Clock::time_point start = Clock::now();
+
+    write_grids(frame.fn_out.c_str(), frame.grids1, frame.metadata);
+    frame.stats.write_time = elapsed(start);
+    return true;
+}
+
+/* Runs one stage of a frame, making sure errors don't escape the pipeline */
+bool run_stage(bool (*stage)(FrameData&), FrameData &frame)
+{
+    try {
+        return stage(frame);
+    }
+    catch (openvdb::Exception& e) {
+        cerr << "Error blending " << frame.fn_out << ": " << e.what() << endl;
+    }
+    catch (std::exception& e) {
+        cerr << "Error blending " << frame.fn_out << ": " << e.what() << endl;
+    }
+
+    return false;
+}
+
+int run_batch_pipelined(istream &in, size_t depth)
+{
+    string line;
+    vector<string> fields;
+    vector<FramePtr> frames;
+
+    while (getline(in, line)) {
+        if (line.empty() || line[0] == '#')
+            continue;
+
+        FramePtr frame(new FrameData);
+
+        if (split_job_line(line, fields)) {
+            frame->fn_out = fields[0];
+            frame->fn_in1 = fields[1];
+            frame->fn_in2 = fields[2];
+            frame->coeff = (float)atof(fields[3].c_str());
+            frame->ok = true;
+        }
+        else {
+            cerr << "Invalid job: " << line << endl;
+            frame->fn_out = fields.empty() ? line : fields[0];
+        }
+
+        frames.push_back(frame);
+    }
+
+    BoundedQueue<FramePtr> read_queue(depth), write_queue(depth);
+    int failed = 0;
+
+    thread reader([&] {
+        for (size_t i = 0; i < frames.size(); i++) {
+            FramePtr frame = frames[i];
+
+            /* The queues hold the only references from here on */
+            frames[i].reset();
+
+            if (frame->ok)
+                frame->ok = run_stage(read_frame, *frame);
+
+            read_queue.push(frame);
+        }
+
+        read_queue.close();
+    });
+
+    thread writer([&] {
+        FramePtr frame;
+
+        while (write_queue.pop(frame)) {
+            if (frame->ok)
+                frame->ok = run_stage(write_frame, *frame);
+
+            if (!frame->ok)
+                failed++;
+
+            log_frame(frame->fn_out, frame->fn_in1, frame->fn_in2, frame->coeff, frame->ok, frame->stats);
+            cout << (frame->ok ? "OK " : "FAILED ") << frame->fn_out << endl;
+
+            /* Release the grids as soon as the frame is done, even after a failed read */
+            frame->grids1.reset();
+            frame->grids2.clear();
+            frame->metadata.reset();
+        }
+    });
+
+    FramePtr frame;
+
+    while (read_queue.pop(frame)) {
+        if (frame->ok)
+            frame->ok = run_stage(blend_frame, *frame);
+
+        write_queue.push(frame);
+    }
+
+    write_queue.close();
+
+    reader.join();
+    writer.join();
+
+    return failed ? 1 : 0;
+}
+
+void usage()
+{
+    cerr << "Usage: openvdb_blend_smoke [options] <outfile> <infile1> <infile2> <coeff>" << endl;
+    cerr << "       openvdb_blend_smoke [options] --batch <jobfile|->" << endl;
+    cerr << "Options:" << endl;
+    cerr << "  -s, --serial                blend on a single thread (reference path for verification)" << endl;
+    cerr << "      --no-dense              don't blend leaves with identical active masks as flat arrays" << endl;
+    cerr << "  -m, --stream                keep at most one grid pair in memory" << endl;
+    cerr << "  -c, --copy                  copy grids that are not blended without decoding (implies -m);" << endl;
+    cerr << "                              has no effect with -z, --half or --preview" << endl;
+    cerr << "  -f, --fields a,b,...        only blend the named grids, passing the others through" << endl;
+    cerr << "  -p, --prune tol             deactivate blended voxels with magnitude at or below tol" << endl;
+    cerr << "  -z, --compression codec     output codec: blosc, zip or none" << endl;
+    cerr << "      --half                  store floating point grids as half floats" << endl;
+    cerr << "      --preview factor        write frames downsampled by 2 or 4, for quick checks;" << endl;
+    cerr << "                              Blender only loads these into adaptive domains" << endl;
+    cerr << "  -L, --load mode             read inputs eager, delayed (default) or mmap: delayed" << endl;
+    cerr << "                              without copying the file, paging leaves in as touched" << endl;
+    cerr << "  -P, --prefetch depth        in batch mode, read and write frames in the background," << endl;
+    cerr << "                              keeping up to depth frames queued (ignores -m and -c)" << endl;
+    cerr << "  -V, --validate              only check that the inputs can be blended, reading no voxel data" << endl;
+    cerr << "  -t, --telemetry log         append JSON lines with per frame and per grid statistics" << endl;
+    cerr << "      --run-id id             tag telemetry records with this run id" << endl;
+}
+
+bool parse_compression(const string &name, uint32_t &flags)
+{
+    if (name == "blosc") {
+        if (!openvdb::io::Archive::hasBloscCompression()) {
+            cerr << "Blosc compression is not available" << endl;
+            return false;
+        }
+
+        flags = openvdb::io::COMPRESS_BLOSC | openvdb::io::COMPRESS_ACTIVE_MASK;
+    }
+    else if (name == "zip")
+        flags = openvdb::io::COMPRESS_ZIP | openvdb::io::COMPRESS_ACTIVE_MASK;
+    else if (name == "none")
+        flags = openvdb::io::COMPRESS_ACTIVE_MASK;
+    else {
+        cerr << "Unknown compression: " << name << endl;
+        return false;
+    }
+
+    return true;
+}
+
+enum {
+    OPT_HALF = 256,
+    OPT_NO_DENSE,
+    OPT_RUN_ID,
+    OPT_PREVIEW,
+};
+
+int main(int argc, char *const argv[])
+{
+    static const struct option long_options[] = {
+        { "batch", required_argument, NULL, 'b' },
+        { "serial", no_argument, NULL, 's' },
+        { "stream", no_argument, NULL, 'm' },
+        { "copy", no_argument, NULL, 'c' },
+        { "fields", required_argument, NULL, 'f' },
+        { "prune", required_argument, NULL, 'p' },
+        { "compression", required_argument, NULL, 'z' },
+        { "half", no_argument, NULL, OPT_HALF },
+        { "prefetch", required_argument, NULL, 'P' },
+        { "no-dense", no_argument, NULL, OPT_NO_DENSE },
+        { "telemetry", required_argument, NULL, 't' },
+        { "run-id", required_argument, NULL, OPT_RUN_ID },
+        { "validate", no_argument, NULL, 'V' },
+        { "load", required_argument, NULL, 'L' },
+        { "preview", required_argument, NULL, OPT_PREVIEW },
+        { NULL, 0, NULL, 0 }
+    };
+
+    const char *fn_batch = NULL;
+    int c;
+
+    while ((c = getopt_long(argc, argv, "b:smcf:p:z:P:t:VL:", long_options, NULL)) != -1) {
+        switch (c) {
+        case 'b':
+            fn_batch = optarg;
+            break;
+        case 's':
+            options.serial = true;
+            break;
+        case 'm':
+            options.stream = true;
+            break;
+        case 'c':
+            options.copy = true;
+            break;
+        case 'f': {
+            istringstream ss(optarg);
+            string field;
+
+            while (getline(ss, field, ','))
+                if (!field.empty())
+                    options.fields.insert(field);
+            break;
+        }
+        case 'p':
+            options.prune = true;
+            options.prune_tolerance = (float)atof(optarg);
+            break;
+        case 'z':
+            if (!parse_compression(optarg, options.compression))
+                return 1;
+            options.recompress = true;
+            break;
+        case OPT_HALF:
+            options.half = true;
+            break;
+        case 'P':
+            options.prefetch = atoi(optarg);
+            break;
+        case OPT_NO_DENSE:
+            options.dense = false;
+            break;
+        case 't':
+            options.telemetry = optarg;
+            break;
+        case OPT_RUN_ID:
+            options.run_id = optarg;
+            break;
+        case 'V':
+            options.validate = true;
+            break;
+        case 'L':
+            if (!strcmp(optarg, "eager"))
+                options.load = LOAD_EAGER;
+            else if (!strcmp(optarg, "delayed"))
+                options.load = LOAD_DELAYED;
+            else if (!strcmp(optarg, "mmap"))
+                options.load = LOAD_MMAP;
+            else {
+                cerr << "Unknown load mode: " << optarg << endl;
+                return 1;
+            }
+            break;
+        case OPT_PREVIEW:
+            options.preview = atoi(optarg);
+
+            if (options.preview != 2 && options.preview != 4) {
+                cerr << "Preview factor must be 2 or 4" << endl;
+                return 1;
+            }
+            break;
+        default:
+            usage();
+            return 1;
+        }
+    }
+
+    openvdb::initialize();
+
+    if (!options.telemetry.empty()) {
+        telemetry.open(options.telemetry.c_str(), ios_base::out | ios_base::app);
+
+        if (!telemetry) {
+            cerr << "Could not open " << options.telemetry << endl;
+            return 1;
+        }
+
+        if (options.run_id.empty()) {
+            ostringstream id;
+            id << time(NULL) << "-" << getpid();
+            options.run_id = id.str();
+        }
+    }
+
+    if (fn_batch) {
+        if (optind != argc) {
+            usage();
+            return 1;
+        }
+
+        ifstream jobs;
+
+        if (string(fn_batch) != "-") {
+            jobs.open(fn_batch);
+
+            if (!jobs) {
+                cerr << "Could not open " << fn_batch << endl;
+                return 1;
+            }
+        }
+
+        istream &in = jobs.is_open() ? (istream&)jobs : cin;
+
+        if (options.prefetch > 0 && !options.validate)
+            return run_batch_pipelined(in, options.prefetch);
+
+        return run_batch(in);
+    }
+
+    if (argc - optind < 4) {
+        usage();
+        return 1;
+    }
+
+    const char *fn_out = argv[optind];
+    const char *fn_in1 = argv[optind+1];
+    const char *fn_in2 = argv[optind+2];
+    float coeff = (float)atof(argv[optind+3]);
 
-    return 0;
+    return run_job(fn_out, fn_in1, fn_in2, coeff) ? 0 : 1;
 }
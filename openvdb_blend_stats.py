@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Summarizes the telemetry log written by openvdb_blend_smoke -t,
+# totalling the per frame and per grid records of each run.
+#
+#   ./openvdb_blend_stats.py telemetry.jsonl
+#   ./openvdb_blend_stats.py --last --json telemetry.jsonl
+
+import argparse
+import collections
+import json
+import sys
+
+FRAME_TOTALS = [
+    'read_time', 'blend_time', 'write_time', 'input_bytes', 'output_bytes',
+    'active_before', 'active_after',
+]
+
+GRID_TOTALS = ['read_time', 'blend_time', 'write_time', 'active_before', 'active_after']
+
+def load_runs(lines):
+    """
+    Groups the telemetry records by run id, keeping the run order.
+    """
+    runs = collections.OrderedDict()
+
+    for line in lines:
+        line = line.strip()
+        if line:
+            rec = json.loads(line)
+            runs.setdefault(rec.get('run', ''), []).append(rec)
+
+    return runs
+
+def summarize_run(records, top):
+    # The last frame record of an output wins: a failed blend is
+    # followed by the symlink the driver falls back to.
+    frames = collections.OrderedDict()
+    blended = []
+    grids = collections.OrderedDict()
+
+    for rec in records:
+        if rec['event'] == 'frame':
+            frames[rec['output']] = rec
+            if rec['status'] == 'blended':
+                blended.append(rec)
+        elif rec['event'] == 'grid':
+            gsum = grids.setdefault(rec['grid'], dict(count=0, **{ k:0 for k in GRID_TOTALS }))
+            gsum['count'] += 1
+            for k in GRID_TOTALS:
+                gsum[k] += rec.get(k, 0)
+
+    status = collections.Counter(rec['status'] for rec in frames.values())
+    totals = { k: sum(rec.get(k, 0) for rec in blended) for k in FRAME_TOTALS }
+
+    def frame_time(rec):
+        return rec.get('read_time', 0) + rec.get('blend_time', 0) + rec.get('write_time', 0)
+
+    slowest = sorted(blended, key=frame_time, reverse=True)[:top]
+
+    return {
+        'frames': len(frames),
+        'status': dict(status),
+        'totals': totals,
+        'grids': grids,
+        'slowest': [ dict(output=rec['output'], time=frame_time(rec)) for rec in slowest ],
+    }
+
+def print_summary(run, summary):
+    totals = summary['totals']
+
+    print('Run %s: %d frames (%s)' % (run, summary['frames'], ', '.join(
+        '%d %s' % (n, st) for st, n in sorted(summary['status'].items()))))
+    print('  time: read %.2fs, blend %.2fs, write %.2fs' % (
+        totals['read_time'], totals['blend_time'], totals['write_time']))
+    print('  bytes: %d in, %d out' % (totals['input_bytes'], totals['output_bytes']))
+    print('  active voxels: %d before, %d after' % (totals['active_before'], totals['active_after']))
+
+    for name, gsum in summary['grids'].items():
+        print('  grid %-12s x%-4d read %.2fs, blend %.2fs, write %.2fs, voxels %d -> %d' % (
+            name, gsum['count'], gsum['read_time'], gsum['blend_time'], gsum['write_time'],
+            gsum['active_before'], gsum['active_after']))
+
+    for rec in summary['slowest']:
+        print('  slow frame %s: %.2fs' % (rec['output'], rec['time']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize openvdb_blend_smoke telemetry.')
+    parser.add_argument('log', nargs='?', help='telemetry log, stdin if omitted')
+    parser.add_argument('--run', help='only summarize this run id')
+    parser.add_argument('--last', action='store_true', help='only summarize the last run')
+    parser.add_argument('--top', type=int, default=5, help='number of slowest frames to list')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    opts = parser.parse_args()
+
+    if opts.log:
+        with open(opts.log) as f:
+            runs = load_runs(f)
+    else:
+        runs = load_runs(sys.stdin)
+
+    if opts.run:
+        runs = { opts.run: runs.get(opts.run, []) }
+    elif opts.last and runs:
+        last = next(reversed(runs))
+        runs = { last: runs[last] }
+
+    summaries = collections.OrderedDict(
+        (run, summarize_run(records, opts.top)) for run, records in runs.items())
+
+    if opts.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        for run, summary in summaries.items():
+            print_summary(run, summary)
+
+if __name__ == '__main__':
+    main()
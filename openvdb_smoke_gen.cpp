@@ -0,0 +1,270 @@
+/*
+ * Generates synthetic Blender style smoke cache files, with the same
+ * blender/smoke metadata as real caches, for benchmarking
+ * openvdb_blend_smoke without production data.
+ */
+
+#include <iostream>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <algorithm>
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <math.h>
+#include <getopt.h>
+
+#include <openvdb/openvdb.h>
+
+using namespace std;
+
+using openvdb::MetaMap;
+using openvdb::GridBase;
+
+using openvdb::Coord;
+using openvdb::Vec3i;
+using openvdb::Vec3s;
+using openvdb::FloatGrid;
+using openvdb::Vec3SGrid;
+
+/* Same bits as the smoke domain data flags in Blender */
+enum {
+    SM_ACTIVE_HEAT = 1 << 0,
+    SM_ACTIVE_FIRE = 1 << 1,
+    SM_ACTIVE_COLORS = 1 << 2,
+};
+
+struct GenOptions {
+    Vec3i resolution;
+    float sparsity;
+    int frame;
+    unsigned seed;
+    unsigned value_seed;
+    bool use_value_seed;
+    vector<string> fields;
+
+    GenOptions() : resolution(64, 64, 64), sparsity(0.5f), frame(1), seed(0), value_seed(0), use_value_seed(false) {}
+};
+
+static GenOptions options;
+
+/* Integer hash to [0,1) */
+float hash_noise(int x, int y, int z, unsigned seed)
+{
+    uint32_t h = (uint32_t)x * 73856093u ^ (uint32_t)y * 19349663u ^ (uint32_t)z * 83492791u ^ seed * 2654435761u;
+
+    h ^= h >> 13;
+    h *= 0x5bd1e995u;
+    h ^= h >> 15;
+
+    return (h & 0xffffff) / float(0x1000000);
+}
+
+/* Trilinear value noise, smooth enough to look like a plume */
+float value_noise(float x, float y, float z, unsigned seed)
+{
+    int ix = (int)floorf(x), iy = (int)floorf(y), iz = (int)floorf(z);
+    float fx = x - ix, fy = y - iy, fz = z - iz;
+    float result = 0.0f;
+
+    for (int dz = 0; dz < 2; dz++)
+        for (int dy = 0; dy < 2; dy++)
+            for (int dx = 0; dx < 2; dx++) {
+                float w = (dx ? fx : 1 - fx) * (dy ? fy : 1 - fy) * (dz ? fz : 1 - fz);
+
+                result += w * hash_noise(ix + dx, iy + dy, iz + dz, seed);
+            }
+
+    return result;
+}
+
+bool is_vector_field(const string &name)
+{
+    return name == "velocity" || name == "color";
+}
+
+int field_flags()
+{
+    int flags = 0;
+
+    for (size_t i = 0; i < options.fields.size(); i++) {
+        const string &name = options.fields[i];
+
+        if (name == "heat")
+            flags |= SM_ACTIVE_HEAT;
+        else if (name == "flame" || name == "fuel")
+            flags |= SM_ACTIVE_FIRE;
+        else if (name == "color")
+            flags |= SM_ACTIVE_COLORS;
+    }
+
+    return flags;
+}
+
+openvdb::GridPtrVec generate_grids()
+{
+    const Vec3i &res = options.resolution;
+    float scale = 8.0f / max(res.x(), max(res.y(), res.z()));
+    float drift = options.frame * 0.05f;
+
+    vector<FloatGrid::Ptr> scalars(options.fields.size());
+    vector<Vec3SGrid::Ptr> vectors(options.fields.size());
+    openvdb::GridPtrVec grids;
+
+    openvdb::math::Transform::Ptr xform = openvdb::math::Transform::createLinearTransform(1.0 / res.x());
+
+    for (size_t i = 0; i < options.fields.size(); i++) {
+        GridBase::Ptr grid;
+
+        if (is_vector_field(options.fields[i]))
+            grid = vectors[i] = Vec3SGrid::create(Vec3s(0.0f));
+        else
+            grid = scalars[i] = FloatGrid::create(0.0f);
+
+        grid->setName(options.fields[i]);
+        grid->setTransform(xform);
+        grids.push_back(grid);
+    }
+
+    vector<FloatGrid::Accessor> scalar_acc;
+    vector<Vec3SGrid::Accessor> vector_acc;
+
+    for (size_t i = 0; i < options.fields.size(); i++) {
+        if (scalars[i])
+            scalar_acc.push_back(scalars[i]->getAccessor());
+        if (vectors[i])
+            vector_acc.push_back(vectors[i]->getAccessor());
+    }
+
+    for (int z = 0; z < res.z(); z++)
+        for (int y = 0; y < res.y(); y++)
+            for (int x = 0; x < res.x(); x++) {
+                float n = value_noise(x * scale, y * scale, z * scale + drift, options.seed);
+
+                if (n < options.sparsity)
+                    continue;
+
+                /* Same active voxels as the plain seed, different values */
+                if (options.use_value_seed)
+                    n = options.sparsity + (1.0f - options.sparsity) *
+                        value_noise(x * scale, y * scale, z * scale + drift, options.value_seed);
+
+                Coord xyz(x, y, z);
+                size_t si = 0, vi = 0;
+
+                for (size_t i = 0; i < options.fields.size(); i++) {
+                    const string &name = options.fields[i];
+
+                    if (name == "velocity")
+                        vector_acc[vi++].setValue(xyz, Vec3s(n - 0.5f, 1.0f, 0.5f - n));
+                    else if (name == "color")
+                        vector_acc[vi++].setValue(xyz, Vec3s(n, 0.5f, 1.0f - n));
+                    else if (name == "flame")
+                        scalar_acc[si++].setValue(xyz, n * n);
+                    else if (name == "heat")
+                        scalar_acc[si++].setValue(xyz, n * 0.5f);
+                    else
+                        scalar_acc[si++].setValue(xyz, n);
+                }
+            }
+
+    for (size_t i = 0; i < grids.size(); i++)
+        grids[i]->addStatsMetadata();
+
+    return grids;
+}
+
+void usage()
+{
+    cerr << "Usage: openvdb_smoke_gen [options] <outfile>" << endl;
+    cerr << "Options:" << endl;
+    cerr << "  -r, --resolution x,y,z      domain resolution (default 64,64,64)" << endl;
+    cerr << "  -s, --sparsity f            fraction of the domain left inactive, 0 to 1 (default 0.5)" << endl;
+    cerr << "  -f, --fields a,b,...        grids to write (default density,flame,heat,velocity,color)" << endl;
+    cerr << "  -n, --frame n               frame number, moves the noise pattern (default 1)" << endl;
+    cerr << "      --seed n                noise seed (default 0)" << endl;
+    cerr << "      --value-seed n          noise seed for the values only, keeping the active voxels of --seed" << endl;
+}
+
+enum {
+    OPT_SEED = 256,
+    OPT_VALUE_SEED,
+};
+
+int main(int argc, char *const argv[])
+{
+    static const struct option long_options[] = {
+        { "resolution", required_argument, NULL, 'r' },
+        { "sparsity", required_argument, NULL, 's' },
+        { "fields", required_argument, NULL, 'f' },
+        { "frame", required_argument, NULL, 'n' },
+        { "seed", required_argument, NULL, OPT_SEED },
+        { "value-seed", required_argument, NULL, OPT_VALUE_SEED },
+        { NULL, 0, NULL, 0 }
+    };
+
+    string fields = "density,flame,heat,velocity,color";
+    int c, rx, ry, rz;
+
+    while ((c = getopt_long(argc, argv, "r:s:f:n:", long_options, NULL)) != -1) {
+        switch (c) {
+        case 'r':
+            if (sscanf(optarg, "%d,%d,%d", &rx, &ry, &rz) != 3 || rx <= 0 || ry <= 0 || rz <= 0) {
+                cerr << "Invalid resolution: " << optarg << endl;
+                return 1;
+            }
+            options.resolution = Vec3i(rx, ry, rz);
+            break;
+        case 's':
+            options.sparsity = (float)atof(optarg);
+            break;
+        case 'f':
+            fields = optarg;
+            break;
+        case 'n':
+            options.frame = atoi(optarg);
+            break;
+        case OPT_SEED:
+            options.seed = (unsigned)atoi(optarg);
+            break;
+        case OPT_VALUE_SEED:
+            options.value_seed = (unsigned)atoi(optarg);
+            options.use_value_seed = true;
+            break;
+        default:
+            usage();
+            return 1;
+        }
+    }
+
+    if (argc - optind != 1) {
+        usage();
+        return 1;
+    }
+
+    istringstream ss(fields);
+    string field;
+
+    while (getline(ss, field, ','))
+        if (!field.empty())
+            options.fields.push_back(field);
+
+    openvdb::initialize();
+
+    /* Metadata checked by openvdb_blend_smoke */
+    MetaMap metadata;
+    int flags = field_flags();
+
+    metadata.insertMeta("blender/smoke/resolution", openvdb::Vec3IMetadata(options.resolution));
+    metadata.insertMeta("blender/smoke/shift", openvdb::Vec3IMetadata(Vec3i(0, 0, 0)));
+    metadata.insertMeta("blender/smoke/fluid_fields", openvdb::Int32Metadata(flags));
+    metadata.insertMeta("blender/smoke/active_fields", openvdb::Int32Metadata(flags));
+
+    openvdb::io::File outfile(argv[optind]);
+
+    outfile.write(generate_grids(), metadata);
+    outfile.close();
+
+    return 0;
+}